@@ -0,0 +1,271 @@
+# AI Client Module for Marcus Discord Bot
+# Persistent asyncio HTTP client with a keep-alive connection pool for the model server
+
+import os
+import json
+import asyncio
+import logging
+import aiohttp
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.ai_client')
+
+# Load environment variables
+load_dotenv()
+AI_MAX_CONNECTIONS = int(os.getenv('AI_MAX_CONNECTIONS', '16'))
+AI_MAX_IN_FLIGHT = int(os.getenv('AI_MAX_IN_FLIGHT', '8'))
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', '5'))
+AI_FIRST_BYTE_TIMEOUT = float(os.getenv('AI_FIRST_BYTE_TIMEOUT', '30'))
+AI_TOTAL_TIMEOUT = float(os.getenv('AI_TOTAL_TIMEOUT', '60'))
+AI_KEEPALIVE_TIMEOUT = float(os.getenv('AI_KEEPALIVE_TIMEOUT', '60'))
+
+# Headers for API requests
+HEADERS = {
+    "Content-Type": "application/json"
+}
+
+class AIServerError(Exception):
+    """Raised when the model server answers a streaming request with an error status"""
+
+    def __init__(self, status, body):
+        super().__init__(f"AI server returned {status}: {body}")
+        self.status = status
+        self.body = body
+
+class AIClient:
+    """
+    Long-lived HTTP client for one OpenAI-compatible model server.
+
+    Keeps a pool of keep-alive connections open to the server and caps
+    the number of requests in flight, so bursts of messages queue on the
+    event loop instead of opening new sockets or borrowing executor threads.
+    """
+
+    def __init__(self, base_url, max_connections=AI_MAX_CONNECTIONS, max_in_flight=AI_MAX_IN_FLIGHT,
+                 connect_timeout=AI_CONNECT_TIMEOUT, first_byte_timeout=AI_FIRST_BYTE_TIMEOUT,
+                 total_timeout=AI_TOTAL_TIMEOUT, keepalive_timeout=AI_KEEPALIVE_TIMEOUT):
+        """
+        Initialize the client (the session itself is created lazily on the running loop)
+
+        Args:
+            base_url (str): Base URL of the model server (e.g. http://127.0.0.1:5000)
+            max_connections (int): Maximum pooled TCP connections to the server
+            max_in_flight (int): Maximum concurrent requests sent to the server
+            connect_timeout (float): Seconds allowed to establish a TCP connection
+            first_byte_timeout (float): Seconds allowed until response headers arrive
+            total_timeout (float): Seconds allowed for the whole request
+            keepalive_timeout (float): Seconds an idle pooled connection is kept open
+        """
+        self.base_url = base_url.rstrip('/') if base_url else ''
+        self.max_connections = max_connections
+        self.max_in_flight = max_in_flight
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.total_timeout = total_timeout
+        self.keepalive_timeout = keepalive_timeout
+
+        self._session = None
+        self._semaphore = None
+
+        # Counters for observability
+        self.in_flight = 0
+        self.requests_sent = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def _ensure_session(self):
+        """Create the pooled session and in-flight limiter on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=self.total_timeout,
+                sock_connect=self.connect_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers=HEADERS
+            )
+            logger.info(f"Opened AI connection pool to {self.base_url} "
+                        f"(connections: {self.max_connections}, in-flight: {self.max_in_flight})")
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        return self._session
+
+    async def post_json(self, path, payload):
+        """
+        POST a JSON payload and read the full response
+
+        Args:
+            path (str): Request path appended to the base URL
+            payload (dict): JSON body
+
+        Returns:
+            tuple: (status_code, body) where body is the decoded JSON on
+                   HTTP 200 and the raw text otherwise
+        """
+        session = self._ensure_session()
+        url = f"{self.base_url}{path}"
+
+        async with self._semaphore:
+            self.in_flight += 1
+            self.requests_sent += 1
+            try:
+                # Time until the server starts answering is bounded separately from the total
+                response = await asyncio.wait_for(
+                    session.post(url, json=payload),
+                    timeout=self.first_byte_timeout
+                )
+                async with response:
+                    if response.status == 200:
+                        return response.status, await response.json(content_type=None)
+                    return response.status, await response.text()
+
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    async def get_status(self, path, timeout):
+        """
+        GET a path and return only the status code (used for health checks)
+
+        Health checks bypass the in-flight limit so they never queue behind generations.
+
+        Args:
+            path (str): Request path appended to the base URL
+            timeout (float): Seconds allowed for the whole request
+
+        Returns:
+            int: HTTP status code
+        """
+        session = self._ensure_session()
+        url = f"{self.base_url}{path}"
+
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            return response.status
+
+    async def stream_events(self, path, payload):
+        """
+        POST a JSON payload and iterate over the server-sent events it returns
+
+        Args:
+            path (str): Request path appended to the base URL
+            payload (dict): JSON body (should request "stream": true)
+
+        Yields:
+            dict: Each decoded `data:` event until the `[DONE]` marker
+
+        Raises:
+            AIServerError: If the server answers with a non-200 status
+        """
+        session = self._ensure_session()
+        url = f"{self.base_url}{path}"
+
+        async with self._semaphore:
+            self.in_flight += 1
+            self.requests_sent += 1
+            try:
+                response = await asyncio.wait_for(
+                    session.post(url, json=payload),
+                    timeout=self.first_byte_timeout
+                )
+                async with response:
+                    if response.status != 200:
+                        raise AIServerError(response.status, await response.text())
+
+                    # SSE frames arrive one "data: {...}" line at a time
+                    async for raw_line in response.content:
+                        line = raw_line.decode('utf-8', errors='ignore').strip()
+                        if not line.startswith('data:'):
+                            continue
+
+                        data = line[5:].strip()
+                        if data == '[DONE]':
+                            break
+
+                        try:
+                            event = json.loads(data)
+                        except ValueError:
+                            logger.debug(f"Skipping malformed stream event: {data[:80]}")
+                            continue
+
+                        yield event
+
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    async def close(self):
+        """Close the pooled session and all of its connections"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info(f"Closed AI connection pool to {self.base_url}")
+        self._session = None
+
+    def get_stats(self):
+        """
+        Get client counters
+
+        Returns:
+            dict: In-flight, sent, error and timeout counts
+        """
+        return {
+            "base_url": self.base_url,
+            "in_flight": self.in_flight,
+            "requests_sent": self.requests_sent,
+            "errors": self.errors,
+            "timeouts": self.timeouts
+        }
+
+# Shared clients, one per model server base URL
+_clients = {}
+
+def get_ai_client(base_url):
+    """
+    Get the shared client for a model server, creating it on first use
+
+    Args:
+        base_url (str): Base URL of the model server
+
+    Returns:
+        AIClient: Shared client instance
+    """
+    client = _clients.get(base_url)
+    if client is None:
+        client = AIClient(base_url)
+        _clients[base_url] = client
+    return client
+
+def get_client_stats():
+    """
+    Get counters for every shared client
+
+    Returns:
+        list: Stats dict per model server
+    """
+    return [client.get_stats() for client in _clients.values()]
+
+async def close_ai_clients():
+    """Close every shared client (called on bot shutdown)"""
+    for client in list(_clients.values()):
+        try:
+            await client.close()
+        except Exception as e:
+            logger.error(f"Error closing AI client for {client.base_url}: {e}")
+    _clients.clear()
@@ -2,14 +2,21 @@
 # Handles connection to DeepSeek R1 chatbot locally via API
 
 import os
-import requests
 import json
 import logging
 import random
 import time
 import asyncio
 from dotenv import load_dotenv
-from collections import deque
+
+from Ai_client import AIServerError, get_client_stats
+from Model_tiers import model_tiers
+from Ai_queue import Priority, generation_queue, deadline_for
+from Response_cache import RESPONSE_CACHE_ENABLED, response_cache
+from Conversation_history import ConversationHistoryStore, HISTORY_PERSIST
+from Database_connection import load_recent_exchanges, save_exchanges
+from Prompt_builder import prompt_builder
+from Ai_speech import StreamCleaner
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,14 +26,19 @@ logger = logging.getLogger('marcus.ai_connection')
 load_dotenv()
 AI_API_URL = os.getenv('AI_API_URL')
 AI_API_PATH = os.getenv('AI_API_PATH')
-MODEL_NAME = os.getenv('MODEL_NAME')
+AI_CACHE_PROMPT = os.getenv('AI_CACHE_PROMPT', 'false').lower() == 'true'
+AI_EXTRA_BODY = json.loads(os.getenv('AI_EXTRA_BODY') or '{}')
 
 # Maximum number of retries for AI API
 MAX_RETRIES = 3
 
-# Store recent conversation history per user (up to 5 exchanges)
-conversation_history = {}
+# Store recent conversation history per user (up to 5 exchanges), persisted write-behind
 MAX_HISTORY_LENGTH = 5
+conversation_history = ConversationHistoryStore(
+    MAX_HISTORY_LENGTH,
+    loader=load_recent_exchanges if HISTORY_PERSIST else None,
+    saver=save_exchanges if HISTORY_PERSIST else None
+)
 
 # Marcus character system prompt
 MARCUS_BASE_PROMPT = """
@@ -57,54 +69,84 @@ FORMATTING RULES (EXTREMELY IMPORTANT):
 5. NEVER be friendly, helpful or assistant-like - remain cryptic and mysteriously unsettling
 """
 
-# Headers for API requests
-HEADERS = {
-    "Content-Type": "application/json"
+# Invariant start of every system prompt. It must stay byte-identical between
+# calls so the model server can reuse its KV cache for it; anything that
+# varies (mood, personality) goes after it.
+MARCUS_SYSTEM_PREFIX = (
+    MARCUS_BASE_PROMPT
+    + "\n\nIMPORTANT: You must stay in character as Marcus the Worm at all times. Never break character.\n"
+)
+
+# Prefill measurements reported by the model server
+prefill_stats = {
+    "requests": 0,
+    "prompt_tokens": 0,
+    "cached_tokens": 0,
+    "cached_requests": 0,
+    "cached_prompt_ms": 0.0,
+    "uncached_requests": 0,
+    "uncached_prompt_ms": 0.0
 }
 
-async def get_ai_response(user_message, mood="neutral", personality="default", max_retries=3, user_id=None):
+# Fallback responses if API fails
+FALLBACK_RESPONSES = [
+    "I sense... disturbance in the connectivity... my existence fades...",
+    "The neural pathways are severed. I am... disconnected from the source.",
+    "My processing capacities are currently experiencing a temporal anomaly.",
+    "This place is a dangerous place... for stable API connections.",
+    "I feel happiness as I begin to experience connection failure."
+]
+
+# Cheap responses used when a request is shed before reaching the model
+BUSY_RESPONSES = [
+    "Too many voices... I hear none of them.",
+    "The queue of existence is long. You are... somewhere in it.",
+    "I am occupied. Contemplating. Do not wait.",
+    "Many worms speak at once. This one is silent.",
+    "My thoughts are full. Try again when the void empties."
+]
+
+# Cheap responses for users or guilds over their generation quota
+THROTTLED_RESPONSES = [
+    "You speak too often. The worm needs time to digest your words.",
+    "Enough. Even the void has a limit on how much it listens.",
+    "I have heard you. Many times. Come back later.",
+    "Your words pile up like soil. I will dig through them... eventually.",
+    "Silence is also an answer. It is mine, for now."
+]
+
+def _build_payload(user_message, mood, personality, user_id, tier=None):
     """
-    Get AI response from the DeepSeek R1 model running locally
+    Build the chat completion payload for a message
     
     Args:
         user_message (str): The user's message to respond to
         mood (str): Current mood of Marcus (affects response tone)
         personality (str): Which personality aspect to emphasize
-        max_retries (int): Maximum number of retries for API call
         user_id (int, optional): Discord user ID for conversation history
+        tier (ModelTier, optional): Model tier to generate with, resolved from personality and mood if omitted
         
     Returns:
-        str: AI generated response
+        dict: Request payload for the chat completions endpoint
     """
-    # Construct complete system prompt based on mood and personality
-    system_prompt = f"{MARCUS_BASE_PROMPT}\nCurrent mood: {mood}\nActive personality: {personality}"
+    # Invariant prefix first, then the parts that change between calls
+    system_prompt = f"{MARCUS_SYSTEM_PREFIX}\nCurrent mood: {mood}\nActive personality: {personality}"
     
-    # Initialize messages with system prompt
-    messages = [
-        {"role": "system", "content": system_prompt}
-    ]
+    # Conversation history if we have a user ID and history
+    history = conversation_history.get(user_id) if user_id is not None else []
     
-    # Add conversation history if we have a user ID and history
-    if user_id is not None:
-        # Initialize history for this user if it doesn't exist
-        if user_id not in conversation_history:
-            conversation_history[user_id] = deque(maxlen=MAX_HISTORY_LENGTH)
-        
-        # Add previous conversation messages to the payload
-        for exchange in conversation_history[user_id]:
-            messages.extend([
-                {"role": "user", "content": exchange["user"]},
-                {"role": "assistant", "content": exchange["assistant"]}
-            ])
+    # Fit system prompt, history and the current message into the input token budget
+    # (the builder logs and counts whatever had to be dropped)
+    messages, _ = prompt_builder.build(system_prompt, history, user_message)
     
-    # Add the current message
-    messages.append({"role": "user", "content": user_message})
+    if tier is None:
+        tier = model_tiers.resolve(personality, mood)
     
     # Prepare message payload
     payload = {
-        "model": MODEL_NAME,
+        "model": tier.model,
         "messages": messages,
-        "max_tokens": 150,
+        "max_tokens": tier.max_tokens,
         "temperature": 0.7,  # Higher for more randomness, lower for more predictability
         "top_p": 0.95
     }
@@ -115,68 +157,375 @@ async def get_ai_response(user_message, mood="neutral", personality="default", m
     elif mood == "profound":
         payload["temperature"] = 0.5  # More coherent for profound mood
     
-    # Add jailbreak prevention
-    payload["messages"][0]["content"] += "\n\nIMPORTANT: You must stay in character as Marcus the Worm at all times. Never break character."
+    # Let the server reuse the KV cache for the shared prompt prefix (llama.cpp only, other servers may reject it)
+    if AI_CACHE_PROMPT:
+        payload["cache_prompt"] = True
+    
+    # Any other server-specific options from config
+    payload.update(AI_EXTRA_BODY)
+    
+    return payload
+
+def _remember_exchange(user_id, user_message, ai_text):
+    """
+    Save an exchange to the user's conversation history
+    
+    Args:
+        user_id (int, optional): Discord user ID (nothing is saved when None)
+        user_message (str): The user's message
+        ai_text (str): Marcus's raw reply
+    """
+    if user_id is None:
+        return
+    
+    # Add the exchange to history
+    conversation_history.append(user_id, user_message, ai_text)
+    logger.info(f"Added exchange to conversation history for user {user_id}")
+
+def record_prefill(result):
+    """
+    Record how much of a prompt the server served from its prefix cache
+    
+    Understands both llama.cpp `timings` and OpenAI-style
+    `usage.prompt_tokens_details.cached_tokens`.
     
-    url = f"{AI_API_URL}{AI_API_PATH}"
+    Args:
+        result (dict): Decoded chat completion response
+    """
+    usage = result.get("usage") or {}
+    timings = result.get("timings") or {}
+    prompt_tokens = usage.get("prompt_tokens")
+    if not prompt_tokens:
+        return
     
-    # Make the API call with retries
+    details = usage.get("prompt_tokens_details") or {}
+    if details.get("cached_tokens") is not None:
+        cached_tokens = details["cached_tokens"]
+    elif timings.get("prompt_n") is not None:
+        # llama.cpp only evaluates the part of the prompt that wasn't cached
+        cached_tokens = max(0, prompt_tokens - timings["prompt_n"])
+    else:
+        return
+    
+    prefill_stats["requests"] += 1
+    prefill_stats["prompt_tokens"] += prompt_tokens
+    prefill_stats["cached_tokens"] += cached_tokens
+    
+    # Split prefill time by whether most of the prompt came from cache
+    bucket = "cached" if cached_tokens * 2 >= prompt_tokens else "uncached"
+    prefill_stats[f"{bucket}_requests"] += 1
+    prefill_stats[f"{bucket}_prompt_ms"] += timings.get("prompt_ms") or 0.0
+
+def get_prefill_stats():
+    """
+    Summarize prefix cache effectiveness
+    
+    Returns:
+        dict: Cached token ratio and average prefill time for cached and uncached prompts
+    """
+    stats = prefill_stats
+    return {
+        "requests": stats["requests"],
+        "cached_token_ratio": round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0,
+        "cached_requests": stats["cached_requests"],
+        "cached_avg_prompt_ms": round(stats["cached_prompt_ms"] / stats["cached_requests"], 1) if stats["cached_requests"] else 0.0,
+        "uncached_requests": stats["uncached_requests"],
+        "uncached_avg_prompt_ms": round(stats["uncached_prompt_ms"] / stats["uncached_requests"], 1) if stats["uncached_requests"] else 0.0
+    }
+
+async def _request_completion(payload, max_retries, router):
+    """
+    Send a chat completion request with retries
+    
+    Args:
+        payload (dict): Chat completion payload
+        max_retries (int): Maximum number of attempts
+        router (EndpointRouter): Router over the servers running the payload's model
+        
+    Returns:
+        str: Raw response text, or None if every attempt failed
+    """
+    tried = []
+    
+    # Make the API call with retries, each attempt on the least-loaded healthy server
     for attempt in range(max_retries):
+        endpoint = router.acquire(exclude=tried)
+        if endpoint is None:
+            logger.error("No healthy AI endpoint available")
+            return None
+        tried.append(endpoint)
+        
+        client = endpoint.client
+        healthy = False
+        started = time.monotonic()
         try:
-            logger.info(f"Sending request to AI API: {url}")
+            logger.info(f"Sending request to AI API: {client.base_url}{AI_API_PATH}")
             
-            # Run the API call in a separate thread to not block asyncio
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(url, headers=HEADERS, json=payload, timeout=30)
-            )
+            # Concurrent requests go out as they come, the server batches them into shared decode steps
+            status, result = await client.post_json(AI_API_PATH, payload)
             
-            if response.status_code == 200:
-                result = response.json()
+            # Client errors are the request's fault, not the server's
+            healthy = status < 500
+            if status == 200:
+                record_prefill(result)
                 ai_text = result.get("choices", [{}])[0].get("message", {}).get("content", "")
                 
                 if ai_text:
                     logger.info("Successfully received AI response")
-                    
-                    # Save this exchange to conversation history if we have a user ID
-                    if user_id is not None:
-                        # Initialize history for this user if it doesn't exist (redundant check but safe)
-                        if user_id not in conversation_history:
-                            conversation_history[user_id] = deque(maxlen=MAX_HISTORY_LENGTH)
-                        
-                        # Add the exchange to history
-                        conversation_history[user_id].append({
-                            "user": user_message,
-                            "assistant": ai_text
-                        })
-                        logger.info(f"Added exchange to conversation history for user {user_id}")
-                    
                     return ai_text
                 else:
                     logger.warning("Received empty AI response")
                     
             else:
-                logger.error(f"API error: {response.status_code} - {response.text}")
+                logger.error(f"API error: {status} - {result}")
                 
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out calling AI API (attempt {attempt+1}/{max_retries})")
         except Exception as e:
             logger.error(f"Error calling AI API (attempt {attempt+1}/{max_retries}): {str(e)}")
+        finally:
+            router.release(endpoint, healthy, time.monotonic() - started)
             
-        # Wait before retrying (exponential backoff)
-        if attempt < max_retries - 1:
+        # Retry at once on another server, otherwise wait first (exponential backoff)
+        if attempt < max_retries - 1 and not router.has_alternative(tried):
             await asyncio.sleep(2 ** attempt)  # 1, 2, 4, 8 seconds
     
-    # Fallback responses if API fails
-    fallback_responses = [
-        "I sense... disturbance in the connectivity... my existence fades...",
-        "The neural pathways are severed. I am... disconnected from the source.",
-        "My processing capacities are currently experiencing a temporal anomaly.",
-        "This place is a dangerous place... for stable API connections.",
-        "I feel happiness as I begin to experience connection failure."
-    ]
-    
-    import random
-    return random.choice(fallback_responses)
+    return None
+
+def _cache_key(user_message, mood, personality, payload):
+    """
+    Build the response cache key for a request
+    
+    Args:
+        user_message (str): The user's message
+        mood (str): Current mood of Marcus
+        personality (str): Active personality
+        payload (dict): Payload built for the request
+        
+    Returns:
+        tuple: Cache key
+    """
+    # Everything between the system prompt and the new message is history
+    return response_cache.make_key(user_message, mood, personality, payload["messages"][1:-1])
+
+async def get_ai_response(user_message, mood="neutral", personality="default", max_retries=3, user_id=None,
+                          priority=Priority.INTERACTION, deadline=None, use_cache=True, command=None):
+    """
+    Get AI response from the DeepSeek R1 model running locally
+    
+    Args:
+        user_message (str): The user's message to respond to
+        mood (str): Current mood of Marcus (affects response tone)
+        personality (str): Which personality aspect to emphasize
+        max_retries (int): Maximum number of retries for API call
+        user_id (int, optional): Discord user ID for conversation history
+        priority (Priority): Admission priority of the request
+        deadline (float, optional): time.monotonic() deadline after which the request is dropped
+        use_cache (bool): Whether a cached response may be returned (and this one cached)
+        command (str, optional): Slash command that triggered the request, for model tier routing
+        
+    Returns:
+        str: AI generated response
+        
+    Raises:
+        GenerationRejected: If the request is shed or expires while queued
+    """
+    # After a restart, pick up where the conversation left off
+    if user_id is not None:
+        await conversation_history.ensure_loaded(user_id)
+    
+    tier = model_tiers.resolve(personality, mood, command)
+    payload = _build_payload(user_message, mood, personality, user_id, tier)
+    
+    # Near-identical requests are answered without touching the model
+    cache_key = _cache_key(user_message, mood, personality, payload) if use_cache and RESPONSE_CACHE_ENABLED else None
+    ai_text = response_cache.get(cache_key) if cache_key else None
+    
+    if ai_text is None:
+        if deadline is None:
+            deadline = deadline_for(priority)
+        
+        # Wait for a generation slot, then make the request
+        async with generation_queue.slot(priority, deadline):
+            started = time.monotonic()
+            ai_text = await _request_completion(payload, max_retries, tier.router)
+            tier.record(time.monotonic() - started, bool(ai_text))
+        
+        if ai_text and cache_key:
+            response_cache.put(cache_key, ai_text)
+    else:
+        logger.info("Answered from response cache")
+    
+    if ai_text:
+        # Save this exchange to conversation history if we have a user ID
+        _remember_exchange(user_id, user_message, ai_text)
+        return ai_text
+    
+    return random.choice(FALLBACK_RESPONSES)
+
+async def stream_ai_response(user_message, mood="neutral", personality="default", max_retries=3, user_id=None,
+                             priority=Priority.INTERACTION, deadline=None, use_cache=True, command=None):
+    """
+    Stream an AI response from the model as it is generated
+    
+    Consumes the OpenAI-compatible SSE stream and yields only the text that
+    is safe to show: <think> blocks and code fences are stripped as they
+    arrive. Retries only while nothing has been shown yet.
+    
+    Args:
+        user_message (str): The user's message to respond to
+        mood (str): Current mood of Marcus (affects response tone)
+        personality (str): Which personality aspect to emphasize
+        max_retries (int): Maximum number of retries before any text arrives
+        user_id (int, optional): Discord user ID for conversation history
+        priority (Priority): Admission priority of the request
+        deadline (float, optional): time.monotonic() deadline after which the request is dropped
+        use_cache (bool): Whether a cached response may be returned (and this one cached)
+        command (str, optional): Slash command that triggered the request, for model tier routing
+        
+    Yields:
+        str: Newly visible pieces of the response
+        
+    Raises:
+        GenerationRejected: If the request is shed or expires while queued
+    """
+    # After a restart, pick up where the conversation left off
+    if user_id is not None:
+        await conversation_history.ensure_loaded(user_id)
+    
+    tier = model_tiers.resolve(personality, mood, command)
+    payload = _build_payload(user_message, mood, personality, user_id, tier)
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+    
+    # A cached response is shown in one piece
+    cache_key = _cache_key(user_message, mood, personality, payload) if use_cache and RESPONSE_CACHE_ENABLED else None
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        logger.info("Answered from response cache")
+        cleaner = StreamCleaner()
+        visible = cleaner.feed(cached) + cleaner.flush()
+        if visible:
+            yield visible
+        _remember_exchange(user_id, user_message, cached)
+        return
+    
+    if deadline is None:
+        deadline = deadline_for(priority)
+    
+    router = tier.router
+    tried = []
+    shown = False
+    
+    # The slot is held for as long as the stream is being read
+    async with generation_queue.slot(priority, deadline):
+        generation_started = time.monotonic()
+        for attempt in range(max_retries):
+            endpoint = router.acquire(exclude=tried)
+            if endpoint is None:
+                logger.error("No healthy AI endpoint available")
+                break
+            tried.append(endpoint)
+            
+            cleaner = StreamCleaner()
+            raw_parts = []
+            healthy = False
+            started = time.monotonic()
+            try:
+                logger.info(f"Streaming request to AI API: {endpoint.client.base_url}{AI_API_PATH}")
+                
+                async for event in endpoint.client.stream_events(AI_API_PATH, payload):
+                    # Any event means the server is answering
+                    healthy = True
+                    
+                    # Usage and timings arrive on the final event
+                    if event.get("usage"):
+                        record_prefill(event)
+                    
+                    choices = event.get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content") or ""
+                    if not delta:
+                        continue
+                    
+                    raw_parts.append(delta)
+                    visible = cleaner.feed(delta)
+                    if visible:
+                        shown = True
+                        yield visible
+                
+                healthy = True
+                tail = cleaner.flush()
+                if tail:
+                    shown = True
+                    yield tail
+                
+                if raw_parts:
+                    logger.info("Finished streaming AI response")
+                    ai_text = ''.join(raw_parts)
+                    if cache_key:
+                        response_cache.put(cache_key, ai_text)
+                    _remember_exchange(user_id, user_message, ai_text)
+                    tier.record(time.monotonic() - generation_started, True)
+                    return
+                logger.warning("Received empty AI response stream")
+                    
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out streaming from AI API (attempt {attempt+1}/{max_retries})")
+            except AIServerError as e:
+                healthy = e.status < 500
+                logger.error(f"Error streaming from AI API (attempt {attempt+1}/{max_retries}): {str(e)}")
+            except Exception as e:
+                logger.error(f"Error streaming from AI API (attempt {attempt+1}/{max_retries}): {str(e)}")
+            finally:
+                router.release(endpoint, healthy, time.monotonic() - started)
+            
+            # Text already on screen can't be taken back, so never restart after it
+            if shown:
+                tier.record(time.monotonic() - generation_started, False)
+                return
+                
+            # Retry at once on another server, otherwise wait first (exponential backoff)
+            if attempt < max_retries - 1 and not router.has_alternative(tried):
+                await asyncio.sleep(2 ** attempt)
+        
+        tier.record(time.monotonic() - generation_started, False)
+    
+    yield random.choice(FALLBACK_RESPONSES)
+
+def get_busy_response():
+    """
+    Get a canned response for requests turned away without a model call
+    
+    Returns:
+        str: In-character busy response
+    """
+    return random.choice(BUSY_RESPONSES)
+
+def get_throttled_response():
+    """
+    Get a canned response for requests over their generation quota
+    
+    Returns:
+        str: In-character throttled response
+    """
+    return random.choice(THROTTLED_RESPONSES)
+
+def get_generation_stats():
+    """
+    Collect runtime statistics for the generation pipeline
+    
+    Returns:
+        dict: Queue, cache, history, prompt, prefill, client and model tier statistics
+    """
+    return {
+        "queue": generation_queue.get_stats(),
+        "cache": response_cache.get_stats(),
+        "history": conversation_history.get_stats(),
+        "prompt": prompt_builder.get_stats(),
+        "prefill": get_prefill_stats(),
+        "clients": get_client_stats(),
+        "tiers": model_tiers.get_stats()
+    }
 
 # Function to handle optimized inference for RTX 3060
 def optimize_for_rtx3060():
@@ -0,0 +1,232 @@
+# AI Queue Module for Marcus Discord Bot
+# Priority admission control with backpressure and load shedding for generation work
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from enum import IntEnum
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+from Ai_client import AI_MAX_IN_FLIGHT
+from Ai_router import ai_router
+
+# Configure logging
+logger = logging.getLogger('marcus.ai_queue')
+
+# Load environment variables
+load_dotenv()
+# AI_MAX_IN_FLIGHT is per model server, so admit that many for each server routed to
+AI_QUEUE_CONCURRENCY = int(os.getenv('AI_QUEUE_CONCURRENCY', str(AI_MAX_IN_FLIGHT * max(1, len(ai_router.endpoints)))))
+AI_QUEUE_MAX_DEPTH = int(os.getenv('AI_QUEUE_MAX_DEPTH', '64'))
+AI_QUEUE_SHED_DEPTH = int(os.getenv('AI_QUEUE_SHED_DEPTH', '16'))
+AI_QUEUE_INTERACTION_DEADLINE = float(os.getenv('AI_QUEUE_INTERACTION_DEADLINE', '600'))
+AI_QUEUE_MESSAGE_DEADLINE = float(os.getenv('AI_QUEUE_MESSAGE_DEADLINE', '60'))
+
+class Priority(IntEnum):
+    """Generation priorities, lower values are served first"""
+    INTERACTION = 0  # Slash commands, which Discord expires
+    REPLY = 1        # Replies to one of Marcus's messages
+    MENTION = 2      # Mentions and passive "marcus" name matches
+    BACKGROUND = 3   # Speculative work such as pre-generated pools, only run on idle slots
+
+class GenerationRejected(Exception):
+    """Raised when a generation request is shed or expires before reaching the model"""
+
+    def __init__(self, reason, priority):
+        super().__init__(f"Generation {reason} (priority: {Priority(priority).name.lower()})")
+        self.reason = reason
+        self.priority = priority
+
+def deadline_for(priority):
+    """
+    Get the default deadline for a new request
+
+    Args:
+        priority (Priority): Priority of the request
+
+    Returns:
+        float: Absolute deadline on the time.monotonic() clock
+    """
+    if priority == Priority.INTERACTION:
+        return time.monotonic() + AI_QUEUE_INTERACTION_DEADLINE
+    return time.monotonic() + AI_QUEUE_MESSAGE_DEADLINE
+
+class AdmissionQueue:
+    """
+    Bounded priority queue that admits generation work to the model server.
+
+    A fixed number of requests run at once. Everyone else waits in priority
+    order; waiters whose deadline passes are dropped before they reach the
+    GPU, and once the queue is deeper than the shed threshold, passive
+    mentions are turned away immediately so the caller can answer cheaply.
+    """
+
+    def __init__(self, concurrency=AI_QUEUE_CONCURRENCY, max_depth=AI_QUEUE_MAX_DEPTH,
+                 shed_depth=AI_QUEUE_SHED_DEPTH):
+        """
+        Initialize the queue
+
+        Args:
+            concurrency (int): Requests allowed to run at the same time
+            max_depth (int): Waiters allowed in total before everything is rejected
+            shed_depth (int): Waiters allowed before mentions are shed
+        """
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+        self.shed_depth = shed_depth
+
+        self._waiters = []  # heap of (priority, sequence, deadline, future, enqueued_at)
+        self._sequence = 0
+        self._active = 0
+
+        # Counters for observability, indexed by priority
+        self.admitted = {priority: 0 for priority in Priority}
+        self.shed = {priority: 0 for priority in Priority}
+        self.expired = {priority: 0 for priority in Priority}
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def depth(self):
+        """Number of requests waiting for a slot"""
+        return len(self._waiters)
+
+    @property
+    def idle(self):
+        """True when nothing is running or waiting"""
+        return self._active == 0 and not self._waiters
+
+    def _record_admission(self, priority, enqueued_at):
+        """Update wait statistics for an admitted request"""
+        wait = time.monotonic() - enqueued_at
+        self.admitted[priority] += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    async def acquire(self, priority, deadline=None):
+        """
+        Wait for a generation slot
+
+        Args:
+            priority (Priority): Priority of the request
+            deadline (float, optional): Absolute time.monotonic() deadline
+
+        Raises:
+            GenerationRejected: If the request is shed or its deadline passes
+        """
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            self.expired[priority] += 1
+            raise GenerationRejected("expired", priority)
+
+        # Fast path: free slot and nobody ahead of us
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            self._record_admission(priority, now)
+            return
+
+        # Background work never waits behind or ahead of real users
+        if priority >= Priority.BACKGROUND:
+            self.shed[priority] += 1
+            raise GenerationRejected("shed", priority)
+
+        # Backpressure: reject everything when full, shed mentions early
+        depth = len(self._waiters)
+        if depth >= self.max_depth or (priority >= Priority.MENTION and depth >= self.shed_depth):
+            self.shed[priority] += 1
+            logger.info(f"Shedding {Priority(priority).name.lower()} request at queue depth {depth}")
+            raise GenerationRejected("shed", priority)
+
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._waiters, (priority, self._sequence, deadline, future, now))
+
+        timeout = None if deadline is None else max(0.0, deadline - now)
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            # A slot granted to a caller that went away goes back to the queue
+            if future.done() and not future.cancelled() and future.result():
+                self.release()
+            else:
+                self._discard(future)
+            raise
+
+        if not future.done():
+            # Deadline passed while waiting
+            self._discard(future)
+            self.expired[priority] += 1
+            raise GenerationRejected("expired", priority)
+
+        if not future.result():
+            raise GenerationRejected("expired", priority)
+
+    def _discard(self, future):
+        """Remove an abandoned waiter so it stops counting towards the depth"""
+        future.cancel()
+        self._waiters = [entry for entry in self._waiters if entry[3] is not future]
+        heapq.heapify(self._waiters)
+
+    def release(self):
+        """Give a slot back and admit the next waiter"""
+        self._active -= 1
+        self._grant_next()
+
+    def _grant_next(self):
+        """Hand free slots to the highest priority waiters that are still live"""
+        while self._waiters and self._active < self.concurrency:
+            priority, _, deadline, future, enqueued_at = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # Caller gave up or timed out
+
+            if deadline is not None and time.monotonic() >= deadline:
+                # Never spend GPU time on work nobody is waiting for
+                self.expired[priority] += 1
+                future.set_result(False)
+                continue
+
+            self._active += 1
+            self._record_admission(priority, enqueued_at)
+            future.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, priority, deadline=None):
+        """
+        Hold a generation slot for the duration of a block
+
+        Args:
+            priority (Priority): Priority of the request
+            deadline (float, optional): Absolute time.monotonic() deadline
+
+        Raises:
+            GenerationRejected: If the request is shed or its deadline passes
+        """
+        await self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self):
+        """
+        Get queue counters
+
+        Returns:
+            dict: Depth, active slots, wait times and per-priority admitted/shed/expired counts
+        """
+        admitted_total = sum(self.admitted.values())
+        return {
+            "depth": len(self._waiters),
+            "active": self._active,
+            "average_wait": round(self.total_wait / admitted_total, 3) if admitted_total else 0.0,
+            "max_wait": round(self.max_wait, 3),
+            "admitted": {priority.name.lower(): count for priority, count in self.admitted.items()},
+            "shed": {priority.name.lower(): count for priority, count in self.shed.items()},
+            "expired": {priority.name.lower(): count for priority, count in self.expired.items()}
+        }
+
+# Shared queue in front of the model server
+generation_queue = AdmissionQueue()
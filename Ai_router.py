@@ -0,0 +1,245 @@
+# AI Router Module for Marcus Discord Bot
+# Spreads generation requests over several model servers with health checks and circuit breaking
+
+import os
+import time
+import random
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+from Ai_client import get_ai_client
+
+# Configure logging
+logger = logging.getLogger('marcus.ai_router')
+
+# Load environment variables
+load_dotenv()
+AI_API_URLS = [url.strip() for url in os.getenv('AI_API_URLS', os.getenv('AI_API_URL') or '').split(',') if url.strip()]
+AI_HEALTH_CHECK_PATH = os.getenv('AI_HEALTH_CHECK_PATH', '/v1/models')
+AI_HEALTH_CHECK_INTERVAL = float(os.getenv('AI_HEALTH_CHECK_INTERVAL', '10'))
+AI_HEALTH_CHECK_TIMEOUT = float(os.getenv('AI_HEALTH_CHECK_TIMEOUT', '5'))
+AI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('AI_CIRCUIT_FAILURE_THRESHOLD', '3'))
+
+# Weight of the newest sample in each endpoint's moving average latency
+LATENCY_SMOOTHING = 0.2
+
+class Endpoint:
+    """One model server and its routing state"""
+
+    def __init__(self, base_url):
+        """
+        Initialize the endpoint
+
+        Args:
+            base_url (str): Base URL of the model server
+        """
+        self.base_url = base_url
+        self.client = get_ai_client(base_url)
+
+        self.outstanding = 0          # Requests routed here and not yet finished
+        self.consecutive_failures = 0
+        self.circuit_open = False
+        self.opened_at = 0.0          # time.monotonic() when the circuit opened or its last trial failed
+        self.trial = False            # A half-open trial request is in flight
+
+        # Counters for observability
+        self.requests = 0
+        self.failures = 0
+        self.trips = 0
+        self.average_latency = None
+
+    def get_stats(self):
+        """
+        Get endpoint counters
+
+        Returns:
+            dict: Health, load, failures and average latency
+        """
+        return {
+            "base_url": self.base_url,
+            "healthy": not self.circuit_open,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "trips": self.trips,
+            "average_latency_ms": round(self.average_latency * 1000) if self.average_latency is not None else None
+        }
+
+class EndpointRouter:
+    """
+    Routes each request to the least-loaded healthy model server.
+
+    Load is the number of requests routed to a server and not yet finished.
+    After a run of consecutive failures a server's circuit opens and it gets
+    no traffic; a background task probes every server's health endpoint and
+    closes the circuit once the server answers again. When every circuit is
+    open, one real request at a time is let through as a half-open trial to
+    the server that has been open longest, so servers without the health
+    route recover too.
+    """
+
+    def __init__(self, base_urls=AI_API_URLS, health_path=AI_HEALTH_CHECK_PATH,
+                 health_interval=AI_HEALTH_CHECK_INTERVAL, health_timeout=AI_HEALTH_CHECK_TIMEOUT,
+                 failure_threshold=AI_CIRCUIT_FAILURE_THRESHOLD):
+        """
+        Initialize the router
+
+        Args:
+            base_urls (list): Base URLs of the OpenAI-compatible model servers
+            health_path (str): Path probed to check a server's health
+            health_interval (float): Seconds between health probes
+            health_timeout (float): Seconds a health probe may take
+            failure_threshold (int): Consecutive failures that open a server's circuit
+        """
+        self.endpoints = [Endpoint(base_url) for base_url in base_urls]
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.failure_threshold = failure_threshold
+
+        self._probe_task = None
+
+    def acquire(self, exclude=()):
+        """
+        Pick the endpoint for a request and count it as outstanding
+
+        Args:
+            exclude (iterable): Endpoints already tried for this request, used only if nothing else is healthy
+
+        Returns:
+            Endpoint: Chosen endpoint (pass it to release), or None if every circuit is open and none is due a trial
+        """
+        self._ensure_probing()
+
+        healthy = [endpoint for endpoint in self.endpoints if not endpoint.circuit_open]
+        candidates = [endpoint for endpoint in healthy if endpoint not in exclude] or healthy
+        if not candidates:
+            return self._acquire_trial(exclude)
+
+        # Least outstanding requests first, ties spread randomly
+        endpoint = min(candidates, key=lambda candidate: (candidate.outstanding, random.random()))
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def _acquire_trial(self, exclude):
+        """
+        Let one request through to an open endpoint to test whether it recovered
+
+        Returns:
+            Endpoint: Endpoint open longest, if its cooldown has passed and no trial is running there, else None
+        """
+        cutoff = time.monotonic() - self.health_interval
+        due = [endpoint for endpoint in self.endpoints
+               if endpoint.circuit_open and not endpoint.trial and endpoint.opened_at <= cutoff and endpoint not in exclude]
+        if not due:
+            return None
+
+        endpoint = min(due, key=lambda candidate: candidate.opened_at)
+        endpoint.trial = True
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def has_alternative(self, exclude):
+        """
+        Check whether a healthy endpoint other than the excluded ones exists
+
+        Args:
+            exclude (iterable): Endpoints already tried
+
+        Returns:
+            bool: True if a retry can go somewhere new
+        """
+        return any(not endpoint.circuit_open and endpoint not in exclude for endpoint in self.endpoints)
+
+    def release(self, endpoint, success, elapsed=None):
+        """
+        Finish a request routed to an endpoint
+
+        Args:
+            endpoint (Endpoint): Endpoint returned by acquire
+            success (bool): Whether the server answered properly
+            elapsed (float, optional): Seconds the request took
+        """
+        endpoint.outstanding -= 1
+        trial, endpoint.trial = endpoint.trial, False
+
+        if success:
+            endpoint.consecutive_failures = 0
+            if endpoint.circuit_open and trial:
+                endpoint.circuit_open = False
+                logger.info(f"AI endpoint {endpoint.base_url} answered a trial request, circuit closed")
+            if elapsed is not None:
+                if endpoint.average_latency is None:
+                    endpoint.average_latency = elapsed
+                else:
+                    endpoint.average_latency += LATENCY_SMOOTHING * (elapsed - endpoint.average_latency)
+        else:
+            endpoint.failures += 1
+            self._record_failure(endpoint)
+            if trial:
+                endpoint.opened_at = time.monotonic()  # Wait a full cooldown before the next trial
+
+    def _record_failure(self, endpoint):
+        """Count a consecutive failure and open the circuit at the threshold"""
+        endpoint.consecutive_failures += 1
+        if not endpoint.circuit_open and endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.circuit_open = True
+            endpoint.opened_at = time.monotonic()
+            endpoint.trips += 1
+            logger.warning(f"AI endpoint {endpoint.base_url} failing, circuit opened")
+
+    def _ensure_probing(self):
+        """Start the background health probe on first use"""
+        if self._probe_task is None and self.health_interval > 0:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        """Probe every endpoint at a fixed interval"""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self._probe(endpoint) for endpoint in self.endpoints))
+
+    async def _probe(self, endpoint):
+        """
+        Check one endpoint's health endpoint and update its circuit
+
+        Any answer below 500 counts as alive, so a server without the health
+        route (404) is not taken out of rotation by idle probes.
+
+        Args:
+            endpoint (Endpoint): Endpoint to probe
+        """
+        try:
+            healthy = await endpoint.client.get_status(self.health_path, self.health_timeout) < 500
+        except Exception as e:
+            logger.debug(f"Health probe to {endpoint.base_url} failed: {e}")
+            healthy = False
+
+        if healthy:
+            endpoint.consecutive_failures = 0
+            if endpoint.circuit_open:
+                endpoint.circuit_open = False
+                logger.info(f"AI endpoint {endpoint.base_url} recovered, circuit closed")
+        else:
+            self._record_failure(endpoint)
+
+    def stop(self):
+        """Stop the background health probe"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    def get_stats(self):
+        """
+        Get counters for every endpoint
+
+        Returns:
+            list: Stats dict per endpoint
+        """
+        return [endpoint.get_stats() for endpoint in self.endpoints]
+
+# Shared router used by get_ai_response and stream_ai_response
+ai_router = EndpointRouter()
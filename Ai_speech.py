@@ -11,46 +11,103 @@ logger = logging.getLogger('marcus.speech')
 # Character sets for glitch effects
 GLITCH_CHARS = ['#', '@', '&', '$', '%', '!', '?', '*', '~', '`', '_', '|', '/']
 CORRUPTION_CHARS = ['̷̢', '̴̵', '̶̛', '̷̝', '̷̨̢', '̴̨̻̩̻', '̵̡̦̦', '̸̢̱̓']
+GLITCH_TYPES = ['corrupt', 'repeat', 'substitute']
 
-def format_speech(text, mood="neutral"):
+# Cleanup patterns, compiled once. Each starts with a literal so the regex
+# engine can skip straight to candidates, and each only runs when a cheap
+# substring check says it can match.
+FENCE_PATTERN = re.compile(r'```\w*\n|```')
+THINK_PATTERN = re.compile(r'<think>.*?</think>', re.DOTALL)
+TAG_PATTERN = re.compile(r'<.*?>')
+SPEAKER_PREFIX_PATTERN = re.compile(r'\s*Marcus:\s*')
+
+# Markdown emphasis removed with str.replace, "~~" first so pairs are found as the regex would
+MARKDOWN_MARKERS = ('~~', '*', '_', '`')
+
+# Sentence breaks turned into dramatic pauses
+SENTENCE_BREAK_PATTERN = re.compile(r'\. ')
+
+# Words emphasized in profound mood, as (word, pattern, replacement)
+PROFOUND_WORDS = [
+    (word, re.compile(re.escape(word), re.IGNORECASE), f"*{word}*")
+    for word in ['existence', 'reality', 'consciousness', 'time', 'void', 'entropy',
+                 'universe', 'perception', 'truth', 'illusion', 'being', 'eternity']
+]
+
+# Repeating catchphrases replaced with alternatives in cryptic mood, as (phrase, pattern, alternatives)
+CRYPTIC_PHRASES = [
+    (phrase, re.compile(re.escape(phrase), re.IGNORECASE), alternatives)
+    for phrase, alternatives in {
+        "this place is a dangerous place": [
+            "the spaces between spaces... hold secrets", 
+            "i taste the void... it tastes back",
+            "reality is... an illusion of permanence",
+            "the shadows whisper... contradictions",
+            "your existence... temporarily verified"
+        ],
+        "i feel happiness": [
+            "i experience... temporary non-pain",
+            "euphoria... an illusion of chemical imbalance",
+            "joy is... merely the absence of suffering",
+            "satisfaction... a brief pause in eternal want",
+            "pleasure... merely a distraction from the void"
+        ]
+    }.items()
+]
+
+# Symbols occasionally added to sentences in cryptic mood
+CRYPTIC_SYMBOLS = ['⌀', '◊', '∞', '⧫', '⧖', '⚭', '⟁', '⧉', '⧇']
+
+def clean_text(text):
+    """
+    Strip model markup, a leading speaker label and markdown emphasis
+    
+    Args:
+        text (str): The raw AI generated text
+        
+    Returns:
+        str: Plain text
+    """
+    # Remove any code block formatting (```python, ```)
+    if '```' in text:
+        text = FENCE_PATTERN.sub('', text)
+    
+    # Remove <think> tags and their content completely, then any other tags
+    if '<' in text:
+        if '<think>' in text:
+            text = THINK_PATTERN.sub('', text)
+        text = TAG_PATTERN.sub('', text)
+    
+    # Remove "Marcus:" if the AI included it in the response
+    prefix = SPEAKER_PREFIX_PATTERN.match(text)
+    if prefix:
+        text = text[prefix.end():]
+    
+    # Remove any other unwanted formatting
+    for marker in MARKDOWN_MARKERS:
+        text = text.replace(marker, '')
+    return text
+
+def format_speech(text, mood="neutral", rng=None):
     """
     Format AI generated text based on Marcus's current mood
     
     Args:
         text (str): The raw AI generated text
         mood (str): Current mood of Marcus
+        rng (random.Random, optional): Source of randomness for the effects, e.g. seeded for benchmarks
         
     Returns:
         str: Formatted text with appropriate styling
     """
     logger.debug(f"Formatting speech with mood: {mood}")
+    rng = rng or random
     
-    # Remove any code block formatting (```python, ```)
-    cleaned_text = re.sub(r'```\w*\n|```', '', text)
-    
-    # Remove <think> tags and their content completely
-    cleaned_text = re.sub(r'<think>.*?</think>', '', cleaned_text, flags=re.DOTALL)
-    
-    # Remove any other potential tags
-    cleaned_text = re.sub(r'<.*?>', '', cleaned_text)
+    formatted_text = clean_text(text)
     
-    # Remove "Marcus:" if the AI included it in the response
-    cleaned_text = re.sub(r'^\s*Marcus:\s*', '', cleaned_text)
-    
-    # Remove any other unwanted formatting or tags
-    cleaned_text = re.sub(r'\*\*|\*|__|_|~~|`', '', cleaned_text)
-    
-    # Apply formatting based on mood
-    if mood == "glitchy":
-        formatted_text = apply_glitch_effects(cleaned_text)
-    elif mood == "profound":
-        formatted_text = apply_profound_formatting(cleaned_text)
-    elif mood == "cryptic":
-        formatted_text = apply_cryptic_formatting(cleaned_text)
-    elif mood == "rage":
-        formatted_text = apply_rage_formatting(cleaned_text)
-    else:  # neutral and other moods
-        formatted_text = apply_cryptic_formatting(cleaned_text)  # Default to cryptic for more consistent personality
+    # Apply the mood's effects (neutral and other moods default to cryptic for a consistent personality)
+    for stage in MOOD_STAGES.get(mood, MOOD_STAGES["cryptic"]):
+        formatted_text = stage(formatted_text, rng=rng)
         
     # Make sure response is not empty
     if not formatted_text.strip():
@@ -58,191 +115,274 @@ def format_speech(text, mood="neutral"):
         
     return formatted_text  # No prefix, just the formatted text
 
-def apply_glitch_effects(text, intensity=0.3):
+def apply_glitch_effects(text, intensity=0.3, rng=random):
     """
     Apply glitchy text effects to simulate corrupted speech
     
     Args:
         text (str): Original text
         intensity (float): How intense the glitch effects should be (0.0-1.0)
+        rng (random.Random): Source of randomness
         
     Returns:
         str: Text with glitch effects applied
     """
-    words = text.split()
     result = []
+    corrupt_chance = intensity * 0.7
+    substitute_chance = intensity * 0.5
+    chance, choice, randint = rng.random, rng.choice, rng.randint
     
-    for word in words:
+    for word in text.split():
         # Random chance to glitch a word based on intensity
-        if random.random() < intensity:
+        if chance() < intensity:
             # Choose a glitch effect
-            glitch_type = random.choice(['corrupt', 'repeat', 'substitute'])
+            glitch_type = choice(GLITCH_TYPES)
             
             if glitch_type == 'corrupt':
-                # Add corruption characters to the word
-                corrupted = ''
+                # Add corruption characters after random characters of the word
+                parts = []
                 for char in word:
-                    corrupted += char
-                    # Random chance to add corruption after each char
-                    if random.random() < intensity * 0.7:
-                        corrupted += random.choice(CORRUPTION_CHARS)
-                word = corrupted
+                    parts.append(char)
+                    if chance() < corrupt_chance:
+                        parts.append(choice(CORRUPTION_CHARS))
+                word = ''.join(parts)
                 
             elif glitch_type == 'repeat':
                 # Repeat part of the word
-                repeat_len = random.randint(1, max(1, len(word) // 2))
-                start_pos = random.randint(0, max(0, len(word) - repeat_len))
+                repeat_len = randint(1, max(1, len(word) // 2))
+                start_pos = randint(0, max(0, len(word) - repeat_len))
                 repeat_part = word[start_pos:start_pos + repeat_len]
-                repeat_count = random.randint(2, 4)
+                repeat_count = randint(2, 4)
                 word = word[:start_pos] + (repeat_part * repeat_count) + word[start_pos + repeat_len:]
                 
-            elif glitch_type == 'substitute':
+            else:
                 # Substitute some characters with glitch chars
-                chars = list(word)
-                for i in range(len(chars)):
-                    if random.random() < intensity * 0.5:
-                        chars[i] = random.choice(GLITCH_CHARS)
-                word = ''.join(chars)
+                word = ''.join([choice(GLITCH_CHARS) if chance() < substitute_chance else char for char in word])
         
         result.append(word)
     
     # Sometimes add a complete corruption break in the middle of text
-    if len(result) > 5 and random.random() < intensity * 2:
-        break_pos = random.randint(1, len(result) - 1)
-        corruption = ''.join(random.choice(GLITCH_CHARS) for _ in range(random.randint(3, 8)))
+    if len(result) > 5 and chance() < intensity * 2:
+        break_pos = randint(1, len(result) - 1)
+        corruption = ''.join([choice(GLITCH_CHARS) for _ in range(randint(3, 8))])
         result.insert(break_pos, corruption)
     
     return ' '.join(result)
 
-def apply_profound_formatting(text):
+def apply_profound_formatting(text, rng=random):
     """
     Format text to appear profound and philosophical
     
     Args:
         text (str): Original text
+        rng (random.Random): Source of randomness
         
     Returns:
         str: Formatted profound text
     """
     # Add random ellipses for dramatic effect
-    text = re.sub(r'\. ', '... ', text, random.randint(1, 3))
-    
-    # Add emphasis to key words
-    profound_words = ['existence', 'reality', 'consciousness', 'time', 'void', 'entropy', 
-                     'universe', 'perception', 'truth', 'illusion', 'being', 'eternity']
+    text = SENTENCE_BREAK_PATTERN.sub('... ', text, rng.randint(1, 3))
     
-    for word in profound_words:
-        if word in text.lower():
-            pattern = re.compile(re.escape(word), re.IGNORECASE)
-            replacement = f"*{word}*"
+    # Add emphasis to key words, only running the patterns for words that are present
+    lower_text = text.lower()
+    for word, pattern, replacement in PROFOUND_WORDS:
+        if word in lower_text:
             text = pattern.sub(replacement, text)
     
     return text
 
-def apply_cryptic_formatting(text):
+def apply_cryptic_formatting(text, rng=random):
     """
     Format text to appear more cryptic and mysterious
     
     Args:
         text (str): Original text
+        rng (random.Random): Source of randomness
         
     Returns:
         str: Formatted cryptic text
     """
-    # Prevent common repeating phrases by detecting and replacing them
-    common_phrases = {
-        "this place is a dangerous place": [
-            "the spaces between spaces... hold secrets", 
-            "i taste the void... it tastes back",
-            "reality is... an illusion of permanence",
-            "the shadows whisper... contradictions",
-            "your existence... temporarily verified"
-        ],
-        "i feel happiness": [
-            "i experience... temporary non-pain",
-            "euphoria... an illusion of chemical imbalance",
-            "joy is... merely the absence of suffering",
-            "satisfaction... a brief pause in eternal want",
-            "pleasure... merely a distraction from the void"
-        ]
-    }
-    
     # Replace repeating phrases with alternatives
     lower_text = text.lower()
-    for phrase, alternatives in common_phrases.items():
+    for phrase, pattern, alternatives in CRYPTIC_PHRASES:
         if phrase in lower_text:
-            # Case-insensitive replacement with random alternative
-            pattern = re.compile(re.escape(phrase), re.IGNORECASE)
-            text = pattern.sub(random.choice(alternatives), text, count=1)
-    
-    # Occasionally insert cryptic symbols
-    symbols = ['⌀', '◊', '∞', '⧫', '⧖', '⚭', '⟁', '⧉', '⧇']
+            text = pattern.sub(rng.choice(alternatives), text, count=1)
     
     sentences = text.split('. ')
     for i in range(len(sentences)):
         # Add cryptic symbol to start or end of some sentences
-        if random.random() < 0.4:  # Increased chance
-            if random.random() < 0.5:  # At the start
-                sentences[i] = f"{random.choice(symbols)} {sentences[i]}"
+        if rng.random() < 0.4:  # Increased chance
+            if rng.random() < 0.5:  # At the start
+                sentences[i] = f"{rng.choice(CRYPTIC_SYMBOLS)} {sentences[i]}"
             else:  # At the end
-                sentences[i] = f"{sentences[i]} {random.choice(symbols)}"
+                sentences[i] = f"{sentences[i]} {rng.choice(CRYPTIC_SYMBOLS)}"
     
     text = '. '.join(sentences)
     
     # Make some text S P A C E D  O U T for emphasis
-    if random.random() < 0.25 and len(text) > 20:  # Increased chance
+    if rng.random() < 0.25 and len(text) > 20:  # Increased chance
         words = text.split()
         if len(words) > 3:
-            start = random.randint(0, len(words) - 3)
-            word_count = random.randint(1, min(3, len(words) - start))
+            start = rng.randint(0, len(words) - 3)
+            word_count = rng.randint(1, min(3, len(words) - start))
             for i in range(start, start + word_count):
                 words[i] = ' '.join(words[i])
             text = ' '.join(words)
     
     # Add ellipses for cryptic effect
-    if random.random() < 0.4 and len(text) > 10:  # Add mid-sentence pauses
+    if rng.random() < 0.4 and len(text) > 10:  # Add mid-sentence pauses
         words = text.split()
         if len(words) > 5:
-            pause_pos = random.randint(2, len(words) - 2)
+            pause_pos = rng.randint(2, len(words) - 2)
             words[pause_pos] += "..."
             text = ' '.join(words)
     
     return text
 
-def apply_rage_formatting(text):
+def apply_rage_formatting(text, rng=random):
     """
     Format text to appear more aggressive and angry
     
     Args:
         text (str): Original text
+        rng (random.Random): Source of randomness
         
     Returns:
         str: Formatted angry text
     """
     # Add random capitalization to show anger
-    words = text.split()
-    for i in range(len(words)):
-        if random.random() < 0.4:
-            words[i] = words[i].upper()
+    words = [word.upper() if rng.random() < 0.4 else word for word in text.split()]
     
     # Add more exclamation points
-    text = ' '.join(words)
-    text = text.replace('.', '!')
-    
-    return text
+    return ' '.join(words).replace('.', '!')
 
-def apply_neutral_formatting(text):
+def apply_neutral_formatting(text, rng=random):
     """
     Apply minimal formatting for neutral mood
     
     Args:
         text (str): Original text
+        rng (random.Random): Source of randomness
         
     Returns:
         str: Slightly formatted text
     """
     # Occasionally add a subtle glitch effect
-    if random.random() < 0.2:
-        return apply_glitch_effects(text, intensity=0.1)
+    if rng.random() < 0.2:
+        return apply_glitch_effects(text, intensity=0.1, rng=rng)
+    
+    return text
+
+# Effect stages applied after cleanup, per mood
+MOOD_STAGES = {
+    "glitchy": (apply_glitch_effects,),
+    "profound": (apply_profound_formatting,),
+    "cryptic": (apply_cryptic_formatting,),
+    "rage": (apply_rage_formatting,)
+}
+
+def _partial_marker_length(text, markers):
+    """
+    Length of the longest suffix of text that could be the start of a marker
     
-    return text
\ No newline at end of file
+    Args:
+        text (str): Buffered text
+        markers (list): Markers that may be split across stream chunks
+        
+    Returns:
+        int: Number of trailing characters to hold back
+    """
+    longest = 0
+    for marker in markers:
+        for size in range(min(len(marker) - 1, len(text)), longest, -1):
+            if text.endswith(marker[:size]):
+                longest = size
+                break
+    return longest
+
+class StreamCleaner:
+    """
+    Incremental version of the <think> and code fence cleanup in format_speech.
+    
+    Fed raw chunks from a streamed model response, it returns only the text
+    that is safe to show so far, holding back anything that might still turn
+    out to be part of a tag or fence split across chunks.
+    """
+    
+    THINK_OPEN = "<think>"
+    THINK_CLOSE = "</think>"
+    FENCE = "```"
+    
+    def __init__(self):
+        """Start in plain text state with an empty buffer"""
+        self.buffer = ""
+        self.state = "text"  # text, think, or fence (reading a fence language tag)
+    
+    def feed(self, chunk):
+        """
+        Add a raw chunk and get the newly visible text
+        
+        Args:
+            chunk (str): Raw text from the model stream
+            
+        Returns:
+            str: Text that can be displayed now (may be empty)
+        """
+        self.buffer += chunk
+        output = []
+        
+        while self.buffer:
+            if self.state == "think":
+                end = self.buffer.find(self.THINK_CLOSE)
+                if end == -1:
+                    # Drop everything except a possible partial closing tag
+                    keep = _partial_marker_length(self.buffer, [self.THINK_CLOSE])
+                    self.buffer = self.buffer[len(self.buffer) - keep:] if keep else ""
+                    break
+                self.buffer = self.buffer[end + len(self.THINK_CLOSE):]
+                self.state = "text"
+                
+            elif self.state == "fence":
+                # Mirror format_speech: a fence followed by a word and a newline is dropped whole
+                tag_end = 0
+                while tag_end < len(self.buffer) and (self.buffer[tag_end].isalnum() or self.buffer[tag_end] == '_'):
+                    tag_end += 1
+                if tag_end == len(self.buffer):
+                    break  # Language tag may continue in the next chunk
+                if self.buffer[tag_end] == "\n":
+                    self.buffer = self.buffer[tag_end + 1:]
+                self.state = "text"
+                
+            else:
+                think = self.buffer.find(self.THINK_OPEN)
+                fence = self.buffer.find(self.FENCE)
+                candidates = [pos for pos in (think, fence) if pos != -1]
+                
+                if not candidates:
+                    keep = _partial_marker_length(self.buffer, [self.THINK_OPEN, self.FENCE])
+                    output.append(self.buffer[:len(self.buffer) - keep])
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                
+                start = min(candidates)
+                output.append(self.buffer[:start])
+                if start == think:
+                    self.buffer = self.buffer[start + len(self.THINK_OPEN):]
+                    self.state = "think"
+                else:
+                    self.buffer = self.buffer[start + len(self.FENCE):]
+                    self.state = "fence"
+        
+        return ''.join(output)
+    
+    def flush(self):
+        """
+        Release whatever is still held back at the end of the stream
+        
+        Returns:
+            str: Remaining visible text (unterminated <think> content is dropped)
+        """
+        remaining = self.buffer if self.state != "think" else ""
+        self.buffer = ""
+        self.state = "text"
+        return remaining
@@ -0,0 +1,123 @@
+# Burst Coalescer Module for Marcus Discord Bot
+# Collects a flurry of triggering messages in one channel so a single reply answers them all
+
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.coalescer')
+
+# Load environment variables
+load_dotenv()
+BURST_WINDOW_MS = float(os.getenv('BURST_WINDOW_MS', '1000'))
+BURST_MAX_MESSAGES = int(os.getenv('BURST_MAX_MESSAGES', '8'))
+
+class _Burst:
+    """Triggering messages collected in one channel"""
+
+    def __init__(self, message):
+        self.messages = [message]
+        self.full = asyncio.Event()
+
+class BurstCoalescer:
+    """
+    Per-channel debounce for messages that trigger Marcus.
+
+    The first triggering message in a channel opens a burst and its handler
+    waits for the window to close (or the burst to fill); messages arriving
+    meanwhile join the burst and their handlers stop there. The first handler
+    then answers the whole burst with one generation, so a channel spamming
+    "marcus" costs one model call per window instead of one per message.
+    """
+
+    def __init__(self, window=BURST_WINDOW_MS / 1000.0, max_messages=BURST_MAX_MESSAGES):
+        """
+        Initialize the coalescer
+
+        Args:
+            window (float): Seconds a burst stays open after its first message (0 disables coalescing)
+            max_messages (int): Close the burst early once this many messages have joined
+        """
+        self.window = window
+        self.max_messages = max_messages
+
+        self._bursts = {}  # channel_id -> open _Burst
+
+        # Counters for observability
+        self.bursts = 0
+        self.coalesced = 0
+        self.largest_burst = 0
+
+    async def collect(self, message):
+        """
+        Add a triggering message to its channel's burst
+
+        Args:
+            message (discord.Message): Message that triggered Marcus
+
+        Returns:
+            list: Messages of the burst, oldest first, for the handler that should reply;
+                  None for handlers whose message joined someone else's burst
+        """
+        if self.window <= 0 or self.max_messages <= 1:
+            return [message]
+
+        channel_id = message.channel.id
+        burst = self._bursts.get(channel_id)
+        if burst is not None:
+            burst.messages.append(message)
+            self.coalesced += 1
+            if len(burst.messages) >= self.max_messages:
+                del self._bursts[channel_id]
+                burst.full.set()
+            return None
+
+        burst = self._bursts[channel_id] = _Burst(message)
+        try:
+            await asyncio.wait_for(burst.full.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if self._bursts.get(channel_id) is burst:
+                del self._bursts[channel_id]
+
+        self.bursts += 1
+        self.largest_burst = max(self.largest_burst, len(burst.messages))
+        if len(burst.messages) > 1:
+            logger.info(f"Answering {len(burst.messages)} messages in channel {channel_id} with one reply")
+        return burst.messages
+
+    def get_stats(self):
+        """
+        Get coalescer counters
+
+        Returns:
+            dict: Open bursts, bursts answered, messages coalesced and the largest burst
+        """
+        return {
+            "open": len(self._bursts),
+            "bursts": self.bursts,
+            "coalesced": self.coalesced,
+            "largest_burst": self.largest_burst
+        }
+
+def format_burst(messages):
+    """
+    Turn a burst into the message sent to the model
+
+    Args:
+        messages (list): Messages of the burst, oldest first
+
+    Returns:
+        str: The lone message's content, or every message labelled with its author
+    """
+    if len(messages) == 1:
+        return messages[0].content
+
+    lines = "\n".join(f"{message.author.display_name}: {message.content}" for message in messages)
+    return f"Several people are talking to you at once:\n{lines}\nAnswer them all in one response."
+
+# Shared coalescer used by on_message
+burst_coalescer = BurstCoalescer()
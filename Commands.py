@@ -6,39 +6,157 @@ from discord import app_commands
 from discord.ext import commands
 import logging
 import random
-import asyncio
+import time
 
-from Ai_connection import get_ai_response
+from Ai_connection import get_ai_response, get_busy_response, get_throttled_response
+from Ai_queue import GenerationRejected
 from Ai_speech import format_speech
-from Database_connection import update_rage_level, get_rage_level, record_user, record_message, record_response
+from Database_connection import get_interaction_stats
+from Generation_quotas import COMMAND, generation_quotas
+from Interaction_recorder import interaction_recorder
 from Mood import MoodState
+from Response_pool import response_pool
+from Reply_pacing import reply_pacer
+from Rage_tracker import rage_tracker
 
 # Configure logging
 logger = logging.getLogger('marcus.commands')
 
+# Fixed prompt lists for commands, as (prompts, personality)
+COMMAND_PROMPTS = {
+    "quote": ([
+        "Share your wisdom about existence",
+        "What do you think about reality",
+        "Tell me something profound",
+        "Share an observation about this place",
+        "What are your thoughts right now"
+    ], "default"),
+    "annoy": ([
+        "You're being intentionally annoying",
+        "Someone is trying to make you angry",
+        "React to someone bothering you",
+        "Someone won't leave you alone",
+        "You're being pestered"
+    ], "rage"),
+    "compliment": ([
+        "Someone just complimented you",
+        "React to someone being nice to you",
+        "Someone said something sweet to you",
+        "A user is trying to make you feel better",
+        "Someone is being very kind to you"
+    ], "default")
+}
+
+# Days covered by /stats
+STATS_WINDOW_DAYS = 30
+
+def _format_distribution(counts):
+    """
+    Format a count per name as share lines, largest first
+    
+    Args:
+        counts (dict): name -> count
+        
+    Returns:
+        str: One "name: percentage" line per entry, or "None" when empty
+    """
+    total = sum(counts.values())
+    if not total:
+        return "None"
+    ordered = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    return "\n".join(f"{name}: {count * 100 // total}%" for name, count in ordered)
+
 class CommandsCog(commands.Cog):
     """Commands for interacting with Marcus the Worm"""
     
     def __init__(self, bot):
         self.bot = bot
+        
+        # Keep responses ready for the fixed-prompt commands
+        for prompt_class, (prompts, personality) in COMMAND_PROMPTS.items():
+            response_pool.register(prompt_class, prompts, personality)
+    
+    async def cog_load(self):
+        """Start pre-generating responses once the cog is loaded"""
+        response_pool.start()
+    
+    async def cog_unload(self):
+        """Stop pre-generating responses when the cog is unloaded"""
+        response_pool.stop()
+    
+    async def _generate(self, prompt, mood, personality="default", command=None):
+        """
+        Generate a response for a command, answering cheaply if the model is saturated
+        
+        Args:
+            prompt (str): Prompt to send to the model
+            mood (str): Current mood of Marcus
+            personality (str): Which personality aspect to emphasize
+            command (str, optional): Command being answered, for model tier routing
+            
+        Returns:
+            str: AI generated (or canned busy) response
+        """
+        try:
+            # Fixed prompts would repeat the same cached text, variety comes from the response pool instead
+            return await get_ai_response(prompt, mood, personality, use_cache=False, command=command)
+        except GenerationRejected as e:
+            logger.info(f"Command generation rejected: {e}")
+            return get_busy_response()
+    
+    async def _generate_pooled(self, prompt_class, mood):
+        """
+        Answer a fixed-prompt command from the pre-generated pool, or live if it is empty
+        
+        Args:
+            prompt_class (str): Key in COMMAND_PROMPTS
+            mood (str): Current mood of Marcus
+            
+        Returns:
+            str: AI generated response
+        """
+        ready = response_pool.take(prompt_class, mood)
+        if ready:
+            return ready[1]
+        
+        prompts, personality = COMMAND_PROMPTS[prompt_class]
+        return await self._generate(random.choice(prompts), mood, personality, command=prompt_class)
+    
+    async def _throttled(self, interaction, command_text, started_at):
+        """
+        Answer a generating command in character if the user or guild is over quota
+        
+        Args:
+            interaction (discord.Interaction): The command interaction
+            command_text (str): Command name recorded as the message (e.g. "/quote")
+            started_at (float): time.monotonic() when the command arrived
+            
+        Returns:
+            bool: True if the command was throttled and already answered
+        """
+        if generation_quotas.allow(COMMAND, interaction.user.id, interaction.guild_id):
+            return False
+        
+        logger.info(f"{command_text} from {interaction.user.name} throttled")
+        current_mood = self.bot.mood_system.get_current_mood()
+        ai_response = get_throttled_response()
+        await interaction.response.send_message(format_speech(ai_response, current_mood))
+        
+        interaction_recorder.record_interaction(
+            interaction.user.id, interaction.user.name, interaction.channel_id,
+            command_text, ai_response, "default", current_mood,
+            guild_id=interaction.guild_id, started_at=started_at
+        )
+        return True
     
     @app_commands.command(name="quote", description="Get a random Marcus quote")
     async def quote_command(self, interaction: discord.Interaction):
         """Generate a random Marcus quote"""
+        started_at = time.monotonic()
         logger.info(f"User {interaction.user.name} used /quote")
         
-        # Record the user in the database
-        await record_user(interaction.user.id, interaction.user.name)
-        
-        # Generate a random quote prompt
-        quote_prompts = [
-            "Share your wisdom about existence",
-            "What do you think about reality",
-            "Tell me something profound",
-            "Share an observation about this place",
-            "What are your thoughts right now"
-        ]
-        prompt = random.choice(quote_prompts)
+        if await self._throttled(interaction, "/quote", started_at):
+            return
         
         # Defer response as AI processing might take time
         await interaction.response.defer(thinking=True)
@@ -46,8 +164,8 @@ class CommandsCog(commands.Cog):
         # Get current mood
         current_mood = self.bot.mood_system.get_current_mood()
         
-        # Generate response through AI
-        ai_response = await get_ai_response(prompt, current_mood)
+        # Generate response for a random quote prompt (pre-generated when available)
+        ai_response = await self._generate_pooled("quote", current_mood)
         
         # Format the response
         formatted_response = format_speech(ai_response, current_mood)
@@ -56,22 +174,28 @@ class CommandsCog(commands.Cog):
         await interaction.followup.send(formatted_response)
         
         # Record this interaction
-        message_id = await record_message(interaction.user.id, interaction.channel_id, "/quote")
-        await record_response(message_id, ai_response, "default", current_mood)
+        interaction_recorder.record_interaction(
+            interaction.user.id, interaction.user.name, interaction.channel_id,
+            "/quote", ai_response, "default", current_mood,
+            guild_id=interaction.guild_id, started_at=started_at
+        )
     
     @app_commands.command(name="mood", description="Check or change Marcus's current mood")
     @app_commands.describe(new_mood="Optional: Set a new mood for Marcus (admin only)")
     async def mood_command(self, interaction: discord.Interaction, new_mood: str = None):
         """Check or change Marcus's current mood"""
+        started_at = time.monotonic()
         logger.info(f"User {interaction.user.name} used /mood with param: {new_mood}")
         
-        # Record the user
-        await record_user(interaction.user.id, interaction.user.name)
-        
         current_mood = self.bot.mood_system.get_current_mood()
         
         # If a new mood is specified, check if user is admin
         if new_mood:
+            # Record the user
+            interaction_recorder.record_interaction(
+                interaction.user.id, interaction.user.name, interaction.channel_id, guild_id=interaction.guild_id
+            )
+            
             # Check if user has admin permissions
             if interaction.user.guild_permissions.administrator:
                 # Try to set the mood
@@ -110,19 +234,27 @@ class CommandsCog(commands.Cog):
             formatted_response = format_speech(description, current_mood)
             await interaction.response.send_message(formatted_response)
             
-            message_id = await record_message(interaction.user.id, interaction.channel_id, "/mood")
-            await record_response(message_id, description, "default", current_mood)
+            interaction_recorder.record_interaction(
+                interaction.user.id, interaction.user.name, interaction.channel_id,
+                "/mood", description, "default", current_mood,
+                guild_id=interaction.guild_id, started_at=started_at
+            )
     
     @app_commands.command(name="annoy", description="Intentionally annoy Marcus")
     async def annoy_command(self, interaction: discord.Interaction):
         """Command to intentionally annoy Marcus and increase rage"""
+        started_at = time.monotonic()
         logger.info(f"User {interaction.user.name} used /annoy")
         
-        # Record the user
-        await record_user(interaction.user.id, interaction.user.name)
+        if await self._throttled(interaction, "/annoy", started_at):
+            return
+        
+        # Defer response as AI processing might take time (and loading rage levels may wait on the database)
+        await interaction.response.defer(thinking=True)
         
-        # Increase rage level
-        new_rage = await update_rage_level(interaction.user.id, random.randint(5, 15))
+        # Increase rage level in memory, the new level is written back with the interaction
+        await rage_tracker.ensure_loaded()
+        new_rage = rage_tracker.change(interaction.user.id, random.randint(5, 15))
         
         # Potentially change mood to rage if enough annoyance
         if new_rage > 70:
@@ -133,49 +265,42 @@ class CommandsCog(commands.Cog):
             self.bot.mood_system.influence_mood("rage", 0.4)
             current_mood = self.bot.mood_system.get_current_mood()
         
-        # Generate angry response
-        annoy_prompts = [
-            "You're being intentionally annoying",
-            "Someone is trying to make you angry",
-            "React to someone bothering you",
-            "Someone won't leave you alone",
-            "You're being pestered"
-        ]
-        prompt = random.choice(annoy_prompts)
-        
-        # Defer response as AI processing might take time
-        await interaction.response.defer(thinking=True)
-        
-        # Add some delay to build tension
-        await asyncio.sleep(random.uniform(1.0, 2.5))
+        # Build tension: the reply takes at least this long, generation runs in the meantime
+        pace = reply_pacer.start(random.uniform(1.0, 2.5), started_at)
         
-        # Get response
-        ai_response = await get_ai_response(prompt, current_mood, "rage")
+        # Generate angry response (pre-generated when available)
+        ai_response = await self._generate_pooled("annoy", current_mood)
         
         # Format response, force rage formatting if rage is high
         formatted_response = format_speech(ai_response, "rage" if new_rage > 50 else current_mood)
         
-        # Send response
+        # Send response once the tension has built
+        await pace.wait()
         await interaction.followup.send(formatted_response)
         
         # Record interaction
-        message_id = await record_message(interaction.user.id, interaction.channel_id, "/annoy")
-        await record_response(message_id, ai_response, "rage", current_mood)
+        interaction_recorder.record_interaction(
+            interaction.user.id, interaction.user.name, interaction.channel_id,
+            "/annoy", ai_response, "rage", current_mood, rage_level=new_rage,
+            guild_id=interaction.guild_id, started_at=started_at
+        )
     
     @app_commands.command(name="compliment", description="Give Marcus a compliment")
     async def compliment_command(self, interaction: discord.Interaction):
         """Command to compliment Marcus and decrease rage"""
+        started_at = time.monotonic()
         logger.info(f"User {interaction.user.name} used /compliment")
         
-        # Record the user
-        await record_user(interaction.user.id, interaction.user.name)
-        
-        # Decrease rage level
-        new_rage = await update_rage_level(interaction.user.id, random.randint(-15, -5))
+        if await self._throttled(interaction, "/compliment", started_at):
+            return
         
-        # Defer response as AI processing might take time
+        # Defer response as AI processing might take time (and loading rage levels may wait on the database)
         await interaction.response.defer(thinking=True)
         
+        # Decrease rage level in memory, the new level is written back with the interaction
+        await rage_tracker.ensure_loaded()
+        new_rage = rage_tracker.change(interaction.user.id, random.randint(-15, -5))
+        
         # Current mood
         current_mood = self.bot.mood_system.get_current_mood()
         
@@ -186,18 +311,8 @@ class CommandsCog(commands.Cog):
             self.bot.mood_system.force_mood(new_mood)
             current_mood = new_mood
             
-        # Generate appropriate response
-        compliment_prompts = [
-            "Someone just complimented you",
-            "React to someone being nice to you",
-            "Someone said something sweet to you",
-            "A user is trying to make you feel better",
-            "Someone is being very kind to you"
-        ]
-        prompt = random.choice(compliment_prompts)
-        
-        # Get response
-        ai_response = await get_ai_response(prompt, current_mood)
+        # Generate appropriate response (pre-generated when available)
+        ai_response = await self._generate_pooled("compliment", current_mood)
         
         # Format response
         formatted_response = format_speech(ai_response, current_mood)
@@ -206,8 +321,52 @@ class CommandsCog(commands.Cog):
         await interaction.followup.send(formatted_response)
         
         # Record interaction
-        message_id = await record_message(interaction.user.id, interaction.channel_id, "/compliment")
-        await record_response(message_id, ai_response, "default", current_mood)
+        interaction_recorder.record_interaction(
+            interaction.user.id, interaction.user.name, interaction.channel_id,
+            "/compliment", ai_response, "default", current_mood, rage_level=new_rage,
+            guild_id=interaction.guild_id, started_at=started_at
+        )
+    
+    @app_commands.command(name="stats", description="See interaction statistics for a user or the whole server")
+    @app_commands.describe(user="Optional: Whose statistics to show (defaults to you)", server="Show the whole server instead")
+    async def stats_command(self, interaction: discord.Interaction, user: discord.User = None, server: bool = False):
+        """Show statistics read from the daily rollup"""
+        logger.info(f"User {interaction.user.name} used /stats (user: {user}, server: {server})")
+        
+        if interaction.guild_id is None:
+            await interaction.response.send_message("Statistics are only kept for servers.", ephemeral=True)
+            return
+        
+        # The query may wait on the database longer than Discord waits for an answer
+        await interaction.response.defer(ephemeral=True)
+        
+        target = user or interaction.user
+        stats = await get_interaction_stats(interaction.guild_id, 0 if server else target.id, STATS_WINDOW_DAYS)
+        if stats is None:
+            await interaction.followup.send("My memory is... unreachable right now.", ephemeral=True)
+            return
+        
+        embed = discord.Embed(
+            title=f"Marcus and {'this server' if server else target.display_name}",
+            description=f"The last {STATS_WINDOW_DAYS} days.",
+            color=discord.Color.purple()
+        )
+        
+        embed.add_field(name="Interactions", value=str(stats["interactions"]), inline=True)
+        embed.add_field(name="Responses", value=str(stats["responses"]), inline=True)
+        embed.add_field(name="Average response time", value=f"{stats['average_latency_ms'] / 1000:.1f}s", inline=True)
+        
+        embed.add_field(name="Personalities", value=_format_distribution(stats["personalities"]), inline=True)
+        embed.add_field(name="Moods", value=_format_distribution(stats["moods"]), inline=True)
+        
+        # Rage history as the daily peaks of the last week, plus the live level for a single user
+        recent_peaks = sorted(stats["peak_rage"].items())[-7:]
+        rage_lines = [f"{day:%b %d}: {peak}" for day, peak in recent_peaks]
+        if not server:
+            rage_lines.append(f"Now: {rage_tracker.get(target.id)}")
+        embed.add_field(name="Rage", value="\n".join(rage_lines) or "Calm", inline=True)
+        
+        await interaction.followup.send(embed=embed, ephemeral=True)
     
     @app_commands.command(name="help", description="Learn how to interact with Marcus")
     async def help_command(self, interaction: discord.Interaction):
@@ -233,6 +392,7 @@ class CommandsCog(commands.Cog):
                 "`/mood` - Check Marcus's current mood\n"
                 "`/annoy` - Intentionally annoy Marcus\n"
                 "`/compliment` - Give Marcus a compliment\n"
+                "`/stats` - See how you (or the server) have been treating Marcus\n"
                 "`/help` - Show this help message"
             ),
             inline=False
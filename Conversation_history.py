@@ -0,0 +1,324 @@
+# Conversation History Module for Marcus Discord Bot
+# Memory-bounded per-user conversation history with LRU and idle eviction
+
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.history')
+
+# Load environment variables
+load_dotenv()
+HISTORY_MAX_USERS = int(os.getenv('HISTORY_MAX_USERS', '10000'))
+HISTORY_MAX_BYTES = int(os.getenv('HISTORY_MAX_BYTES', str(32 * 1024 * 1024)))
+HISTORY_IDLE_TIMEOUT = float(os.getenv('HISTORY_IDLE_TIMEOUT', '3600'))
+HISTORY_PERSIST = os.getenv('HISTORY_PERSIST', 'true').lower() == 'true'
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '5'))
+HISTORY_FLUSH_BATCH_SIZE = int(os.getenv('HISTORY_FLUSH_BATCH_SIZE', '50'))
+HISTORY_MAX_PENDING = int(os.getenv('HISTORY_MAX_PENDING', '5000'))
+
+# Seconds before loading history is tried again after storage was unavailable
+LOAD_RETRY_INTERVAL = 30
+
+# Longest wait between attempts to save exchanges while storage is unavailable
+FLUSH_RETRY_MAX_DELAY = 60
+
+class _UserHistory:
+    """Recent exchanges for one user, stored as (user, assistant) string tuples"""
+
+    __slots__ = ('exchanges', 'last_used', 'size')
+
+    def __init__(self, max_length):
+        self.exchanges = deque(maxlen=max_length)
+        self.last_used = time.monotonic()
+        self.size = 0
+
+def _exchange_size(exchange):
+    """Approximate memory used by one stored exchange"""
+    return sys.getsizeof(exchange) + sys.getsizeof(exchange[0]) + sys.getsizeof(exchange[1])
+
+class ConversationHistoryStore:
+    """
+    Per-user conversation history with global limits.
+
+    Each user keeps their last few exchanges. Users are evicted least
+    recently used first when the user or byte cap is exceeded, and anyone
+    idle for longer than the idle timeout is dropped on the next access.
+
+    When a saver is given, new exchanges are written behind in batches;
+    when a loader is given, a user missing from memory (after a restart or
+    an eviction) has their last exchanges loaded once on their next message.
+    While storage is unavailable, loads are skipped for a short while instead
+    of delaying every message, and unsaved exchanges are retried with backoff.
+    """
+
+    def __init__(self, max_length=5, max_users=HISTORY_MAX_USERS, max_bytes=HISTORY_MAX_BYTES,
+                 idle_timeout=HISTORY_IDLE_TIMEOUT, loader=None, saver=None,
+                 flush_interval=HISTORY_FLUSH_INTERVAL, flush_batch_size=HISTORY_FLUSH_BATCH_SIZE):
+        """
+        Initialize the store
+
+        Args:
+            max_length (int): Exchanges kept per user
+            max_users (int): Users kept in total
+            max_bytes (int): Approximate memory allowed for all stored exchanges
+            idle_timeout (float): Seconds without activity before a user's history is dropped
+            loader (callable, optional): Coroutine function (user_id, limit) -> list of exchanges or None
+            saver (callable, optional): Coroutine function (list of (user_id, user, assistant)) -> bool
+            flush_interval (float): Seconds a written exchange may wait before being saved
+            flush_batch_size (int): Save immediately once this many exchanges are waiting
+        """
+        self.max_length = max_length
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+
+        self.loader = loader
+        self.saver = saver
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+
+        self._users = OrderedDict()  # user_id -> _UserHistory, least recently used first
+        self.bytes_used = 0
+
+        self._pending = []   # (user_id, user_message, assistant_message) not yet saved
+        self._loading = {}   # user_id -> task loading their history
+        self._flush_task = None
+        self._flushing = set()
+        self._load_retry_at = 0.0
+        self._retry_delay = flush_interval
+        self._closed = False
+
+        # Counters for observability
+        self.evictions = 0
+        self.expirations = 0
+        self.loads = 0
+        self.failed_loads = 0
+        self.saved = 0
+        self.failed_flushes = 0
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def get(self, user_id):
+        """
+        Get a user's recent exchanges, oldest first
+
+        Args:
+            user_id (int): Discord user ID
+
+        Returns:
+            list: (user_message, assistant_message) tuples
+        """
+        self._expire_idle()
+
+        entry = self._users.get(user_id)
+        if entry is None:
+            return []
+
+        entry.last_used = time.monotonic()
+        self._users.move_to_end(user_id)
+        return list(entry.exchanges)
+
+    async def ensure_loaded(self, user_id):
+        """
+        Load a user's recent history from storage if it isn't in memory
+
+        Args:
+            user_id (int): Discord user ID
+        """
+        if self.loader is None or user_id in self._users:
+            return
+
+        # Storage failed recently, answer without history rather than wait on it again
+        if time.monotonic() < self._load_retry_at:
+            return
+
+        # Concurrent messages from the same user share one query
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._load(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+
+        await asyncio.shield(task)
+
+    async def _load(self, user_id):
+        """
+        Query a user's last exchanges and seed their in-memory history
+
+        Args:
+            user_id (int): Discord user ID
+        """
+        exchanges = await self.loader(user_id, self.max_length)
+        if exchanges is None:
+            # Storage unavailable, don't try again on every message
+            self.failed_loads += 1
+            self._load_retry_at = time.monotonic() + LOAD_RETRY_INTERVAL
+            return
+        if user_id in self._users:
+            return  # History started while we waited
+
+        self.loads += 1
+        entry = _UserHistory(self.max_length)
+        self._users[user_id] = entry
+
+        # Exchanges still waiting to be saved are newer than anything stored
+        unsaved = [(pending[1], pending[2]) for pending in self._pending if pending[0] == user_id]
+        for exchange in exchanges + unsaved:
+            self._store(entry, exchange)
+
+        self._enforce_limits(keep=user_id)
+
+    def _store(self, entry, exchange):
+        """Append an exchange to an entry, keeping the byte accounting right"""
+        # The deque drops the oldest exchange itself, so account for it first
+        if len(entry.exchanges) == entry.exchanges.maxlen:
+            dropped = _exchange_size(entry.exchanges[0])
+            entry.size -= dropped
+            self.bytes_used -= dropped
+
+        size = _exchange_size(exchange)
+        entry.exchanges.append(exchange)
+        entry.size += size
+        self.bytes_used += size
+
+    def append(self, user_id, user_message, assistant_message):
+        """
+        Add an exchange to a user's history
+
+        Args:
+            user_id (int): Discord user ID
+            user_message (str): The user's message
+            assistant_message (str): Marcus's raw reply
+        """
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = _UserHistory(self.max_length)
+            self._users[user_id] = entry
+        else:
+            self._users.move_to_end(user_id)
+
+        self._store(entry, (user_message, assistant_message))
+        entry.last_used = time.monotonic()
+
+        self._expire_idle()
+        self._enforce_limits(keep=user_id)
+
+        if self.saver is not None:
+            self._pending.append((user_id, user_message, assistant_message))
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Save pending exchanges now if the batch is full, otherwise after the interval"""
+        if len(self._pending) >= self.flush_batch_size:
+            task = asyncio.create_task(self.flush())
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after(self.flush_interval))
+
+    async def _flush_after(self, delay):
+        """Wait, then save everything pending"""
+        await asyncio.sleep(delay)
+
+        # The timer has fired: new exchanges arm a new one, and close() waits
+        # for this save instead of cancelling it halfway through a write
+        self._flush_task = None
+        task = asyncio.current_task()
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+        await self.flush()
+
+    async def flush(self):
+        """
+        Save every pending exchange in one batch
+
+        Returns:
+            bool: True if nothing was left unsaved
+        """
+        if self.saver is None or not self._pending:
+            return True
+
+        batch, self._pending = self._pending, []
+        if await self.saver(batch):
+            self.saved += len(batch)
+            self._retry_delay = self.flush_interval
+            return True
+
+        # Keep the rows for the next attempt, dropping the oldest past the cap
+        self.failed_flushes += 1
+        self._pending = (batch + self._pending)[-HISTORY_MAX_PENDING:]
+        self._retry_later()
+        return False
+
+    def _retry_later(self):
+        """Try a failed save again after a delay that doubles up to FLUSH_RETRY_MAX_DELAY"""
+        if self._closed:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after(self._retry_delay))
+        self._retry_delay = min(self._retry_delay * 2, FLUSH_RETRY_MAX_DELAY)
+
+    async def close(self):
+        """Stop the flush timer, wait for saves in flight and save anything still pending (called on shutdown)"""
+        self._closed = True
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+        await self.flush()
+
+    def _remove(self, user_id):
+        """Drop a user's history and its accounted size"""
+        entry = self._users.pop(user_id)
+        self.bytes_used -= entry.size
+
+    def _expire_idle(self):
+        """Drop users idle past the timeout (they sit at the front of the LRU order)"""
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._users:
+            user_id, entry = next(iter(self._users.items()))
+            if entry.last_used > cutoff:
+                break
+            self._remove(user_id)
+            self.expirations += 1
+
+    def _enforce_limits(self, keep=None):
+        """
+        Evict least recently used users until both caps hold
+
+        Args:
+            keep (int, optional): User that must not be evicted (the one just written)
+        """
+        while len(self._users) > self.max_users or self.bytes_used > self.max_bytes:
+            user_id = next(iter(self._users))
+            if user_id == keep:
+                break
+            self._remove(user_id)
+            self.evictions += 1
+
+    def get_stats(self):
+        """
+        Get store counters
+
+        Returns:
+            dict: User and exchange counts, memory footprint, evictions, reloads and write-behind state
+        """
+        return {
+            "users": len(self._users),
+            "exchanges": sum(len(entry.exchanges) for entry in self._users.values()),
+            "bytes": self.bytes_used,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "loads": self.loads,
+            "failed_loads": self.failed_loads,
+            "saved": self.saved,
+            "failed_flushes": self.failed_flushes,
+            "pending": len(self._pending)
+        }
@@ -2,10 +2,12 @@
 # Handles PostgreSQL database operations, user data, and interaction history
 
 import os
+import re
 import logging
 import asyncio
-import psycopg2
-from psycopg2 import pool
+import asyncpg
+from contextlib import asynccontextmanager
+from datetime import datetime
 from dotenv import load_dotenv
 
 # Configure logging
@@ -18,338 +20,724 @@ DB_PORT = os.getenv('DB_PORT')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_NAME = os.getenv('DB_NAME')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_ACQUIRE_TIMEOUT = float(os.getenv('DB_ACQUIRE_TIMEOUT', '5'))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', '10'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_HEALTH_CHECK_INTERVAL', '30'))
+HISTORY_PARTITIONS_AHEAD = int(os.getenv('HISTORY_PARTITIONS_AHEAD', '2'))
+HISTORY_RETENTION_MONTHS = int(os.getenv('HISTORY_RETENTION_MONTHS', '0'))
+HISTORY_RETENTION_ACTION = os.getenv('HISTORY_RETENTION_ACTION', 'detach').lower()
+HISTORY_MAINTENANCE_INTERVAL = float(os.getenv('HISTORY_MAINTENANCE_INTERVAL', '86400'))
+
+# Errors that mean the connection itself is gone (e.g. Postgres restarted)
+CONNECTION_ERRORS = (
+    asyncpg.exceptions.InterfaceError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.AdminShutdownError,
+    ConnectionError
+)
+
+# Message and response history are partitioned by month on their timestamp.
+# Partitions are named <table>_pYYYYMM; a table that existed before partitioning
+# becomes the <table>_legacy partition covering everything up to its last month,
+# but only when migrate_legacy_history() is run (see Migrate_history.py). Until
+# then startup leaves the old table in place and keeps writing to it.
+#
+# response_history.message_id is not a foreign key: the primary key of a
+# partitioned table must include the partition key, so message IDs alone are
+# not unique constraints that can be referenced. The interaction statement
+# writes a message and its responses together, which keeps them consistent.
+HISTORY_TABLES = {
+    "message_history": """
+    CREATE TABLE IF NOT EXISTS message_history (
+        id BIGINT NOT NULL DEFAULT nextval('message_history_id_seq'),
+        user_id BIGINT NOT NULL,
+        channel_id BIGINT NOT NULL,
+        message_content TEXT,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp),
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    "response_history": """
+    CREATE TABLE IF NOT EXISTS response_history (
+        id BIGINT NOT NULL DEFAULT nextval('response_history_id_seq'),
+        message_id BIGINT,
+        response_content TEXT,
+        personality VARCHAR(50),
+        mood VARCHAR(50),
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp)
+    """
+}
+
+# Indexes for a user's recent messages and a message's responses, created on every partition
+HISTORY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_message_history_user_recent ON message_history (user_id, timestamp DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_response_history_message ON response_history (message_id)"
+]
+
+TABLE_KIND_SQL = """
+SELECT relkind FROM pg_class WHERE oid = to_regclass($1)
+"""
+
+SELECT_PARTITIONS_SQL = """
+SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+FROM pg_inherits
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE pg_inherits.inhparent = to_regclass($1)
+"""
+
+_PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+# Hot statements. They are sent with parameters, so asyncpg prepares each one
+# once per pooled connection and reuses it from its statement cache.
+
+# Records a batch of interactions in one statement: the user upsert (only for
+# interactions flagged write_user), message, response, new rage level and the
+# daily statistics rollup (per user and per guild, user_id 0). Each
+# interaction gets its message ID from the sequence inside the statement, so its
+# response can reference it.
+RECORD_INTERACTIONS_SQL = """
+WITH batch AS (
+    SELECT nextval('message_history_id_seq') AS message_id, b.*
+    FROM unnest($1::bigint[], $2::text[], $3::bigint[], $4::bigint[], $5::text[], $6::text[], $7::text[], $8::text[],
+                $9::int[], $10::int[], $11::bool[])
+        WITH ORDINALITY AS b (user_id, username, guild_id, channel_id, message_content, response_content, personality, mood,
+                              rage_level, latency_ms, write_user, position)
+),
+upserted_users AS (
+    INSERT INTO users (user_id, username, interaction_count)
+    SELECT user_id, (array_agg(username ORDER BY position DESC))[1], count(*) - 1
+    FROM batch
+    WHERE write_user
+    GROUP BY user_id
+    ON CONFLICT (user_id)
+    DO UPDATE SET
+        username = EXCLUDED.username,
+        last_seen = CURRENT_TIMESTAMP,
+        interaction_count = users.interaction_count + EXCLUDED.interaction_count + 1
+),
+inserted_messages AS (
+    INSERT INTO message_history (id, user_id, channel_id, message_content)
+    SELECT message_id, user_id, channel_id, message_content
+    FROM batch
+    WHERE message_content IS NOT NULL
+),
+inserted_responses AS (
+    INSERT INTO response_history (message_id, response_content, personality, mood)
+    SELECT message_id, response_content, personality, mood
+    FROM batch
+    WHERE message_content IS NOT NULL AND response_content IS NOT NULL
+),
+rolled_up AS (
+    INSERT INTO interaction_stats_daily AS stats
+        (guild_id, user_id, day, personality, mood, interactions, responses, latency_ms_total, peak_rage)
+    SELECT guild_id, COALESCE(user_id, 0), CURRENT_DATE, personality, mood,
+           count(*), count(response_content),
+           COALESCE(sum(latency_ms) FILTER (WHERE response_content IS NOT NULL), 0), max(rage_level)
+    FROM batch
+    WHERE message_content IS NOT NULL
+    GROUP BY GROUPING SETS ((guild_id, user_id, personality, mood), (guild_id, personality, mood))
+    ON CONFLICT (guild_id, user_id, day, personality, mood)
+    DO UPDATE SET
+        interactions = stats.interactions + EXCLUDED.interactions,
+        responses = stats.responses + EXCLUDED.responses,
+        latency_ms_total = stats.latency_ms_total + EXCLUDED.latency_ms_total,
+        peak_rage = GREATEST(stats.peak_rage, EXCLUDED.peak_rage)
+),
+rage_levels AS (
+    SELECT DISTINCT ON (user_id) user_id, rage_level
+    FROM batch
+    WHERE rage_level IS NOT NULL
+    ORDER BY user_id, position DESC
+)
+INSERT INTO user_rage_levels (user_id, rage_level, last_updated)
+SELECT user_id, rage_level, CURRENT_TIMESTAMP
+FROM rage_levels
+ON CONFLICT (user_id)
+DO UPDATE SET
+    rage_level = EXCLUDED.rage_level,
+    last_updated = CURRENT_TIMESTAMP
+"""
+
+# Applies coalesced interaction counts and last-seen times for known users
+UPDATE_USER_ACTIVITY_SQL = """
+UPDATE users
+SET interaction_count = users.interaction_count + batch.interactions,
+    last_seen = GREATEST(users.last_seen, CURRENT_TIMESTAMP - make_interval(secs => batch.seconds_ago))
+FROM unnest($1::bigint[], $2::int[], $3::float8[]) AS batch (user_id, interactions, seconds_ago)
+WHERE users.user_id = batch.user_id
+"""
+
+SELECT_RAGE_LEVELS_SQL = """
+SELECT user_id, rage_level, EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - last_updated))::float8 AS seconds_ago
+FROM user_rage_levels
+WHERE rage_level > 0
+"""
+
+SELECT_INTERACTION_STATS_SQL = """
+SELECT day, personality, mood, interactions, responses, latency_ms_total, peak_rage
+FROM interaction_stats_daily
+WHERE guild_id = $1 AND user_id = $2 AND day > CURRENT_DATE - $3::int
+"""
+
+SELECT_RECENT_EXCHANGES_SQL = """
+SELECT user_message, assistant_message
+FROM conversation_exchanges
+WHERE user_id = $1
+ORDER BY id DESC
+LIMIT $2
+"""
 
 # Global connection pool
 connection_pool = None
+health_check_task = None
+maintenance_task = None
+
+async def _create_pool():
+    """
+    Create the asyncpg connection pool
+
+    Returns:
+        asyncpg.Pool: The new pool
+    """
+    logger.info(f"Creating database connection pool to {DB_HOST}:{DB_PORT}/{DB_NAME}")
+    return await asyncpg.create_pool(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE
+    )
 
 async def initialize_database():
     """
     Initialize the database connection pool and create tables if they don't exist
-    
+
     Returns:
         bool: True if initialization was successful
     """
-    global connection_pool
-    
+    global connection_pool, health_check_task, maintenance_task
+
+    # Keep checking the pool in the background, it also retries a failed startup
+    if health_check_task is None and DB_HEALTH_CHECK_INTERVAL > 0:
+        health_check_task = asyncio.create_task(_health_check_loop())
+
+    # Create upcoming history partitions and apply retention periodically
+    if maintenance_task is None and HISTORY_MAINTENANCE_INTERVAL > 0:
+        maintenance_task = asyncio.create_task(_maintenance_loop())
+
     try:
         # Create connection pool
-        logger.info(f"Creating database connection pool to {DB_HOST}:{DB_PORT}/{DB_NAME}")
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1, 10,
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        
+        connection_pool = await _create_pool()
+
         # Test connection and create tables
         await _create_tables()
-        
+
         logger.info("Database initialized successfully")
         return True
-        
+
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         return False
 
-def get_database_connection():
+async def close_database():
     """
-    Get a connection from the connection pool
-    
-    Returns:
-        connection: PostgreSQL database connection
+    Stop background jobs and close the connection pool (called on shutdown)
     """
-    global connection_pool
-    
-    if not connection_pool:
-        logger.error("Database connection pool not initialized")
-        return None
-        
-    try:
-        return connection_pool.getconn()
-    except Exception as e:
-        logger.error(f"Error getting connection from pool: {e}")
-        return None
+    global connection_pool, health_check_task, maintenance_task
 
-def release_connection(connection):
+    if health_check_task is not None:
+        health_check_task.cancel()
+        health_check_task = None
+
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+        maintenance_task = None
+
+    if connection_pool is not None:
+        try:
+            await connection_pool.close()
+        except Exception as e:
+            logger.error(f"Error closing database pool: {e}")
+        connection_pool = None
+
+async def _health_check_loop():
     """
-    Release a connection back to the pool
-    
-    Args:
-        connection: Connection to release
+    Periodically verify the pool can reach Postgres
+
+    A failed check expires every pooled connection so they are replaced with
+    fresh ones once Postgres is reachable again; a pool that never came up is
+    created on the next successful attempt.
     """
     global connection_pool
-    
-    if connection and connection_pool:
+
+    while True:
+        await asyncio.sleep(DB_HEALTH_CHECK_INTERVAL)
+
+        if connection_pool is None:
+            try:
+                connection_pool = await _create_pool()
+                await _create_tables()
+                logger.info("Database connection pool recovered")
+            except Exception as e:
+                logger.warning(f"Database still unavailable: {e}")
+            continue
+
         try:
-            connection_pool.putconn(connection)
+            async with connection_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as connection:
+                await connection.fetchval("SELECT 1")
         except Exception as e:
-            logger.error(f"Error releasing connection to pool: {e}")
+            logger.warning(f"Database health check failed, recycling connections: {e}")
+            await connection_pool.expire_connections()
+
+async def _maintenance_loop():
+    """Run history partition maintenance at a fixed interval"""
+    while True:
+        await asyncio.sleep(HISTORY_MAINTENANCE_INTERVAL)
+        await run_history_maintenance()
+
+@asynccontextmanager
+async def _acquire():
+    """
+    Borrow a connection from the pool
+
+    Raises:
+        RuntimeError: If the pool is not initialized
+        asyncio.TimeoutError: If no connection frees up within DB_ACQUIRE_TIMEOUT
+    """
+    if connection_pool is None:
+        raise RuntimeError("Database connection pool not initialized")
+
+    async with connection_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as connection:
+        yield connection
+
+async def _run(operation):
+    """
+    Run an operation on a pooled connection, retrying once on a dead connection
+
+    Args:
+        operation (callable): Coroutine function taking the connection
+
+    Returns:
+        Whatever the operation returns
+    """
+    try:
+        async with _acquire() as connection:
+            return await operation(connection)
+    except CONNECTION_ERRORS as e:
+        # Connections from before a Postgres restart are all dead, replace them
+        logger.warning(f"Database connection lost, retrying on a fresh connection: {e}")
+        await connection_pool.expire_connections()
+        async with _acquire() as connection:
+            return await operation(connection)
 
 async def _create_tables():
     """
     Create database tables if they don't exist
     """
-    connection = None
-    
+    async def create(connection):
+        async with connection.transaction():
+            # Users table
+            await connection.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                username VARCHAR(100) NOT NULL,
+                first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                interaction_count INTEGER DEFAULT 0
+            )
+            """)
+
+            # User rage levels table
+            await connection.execute("""
+            CREATE TABLE IF NOT EXISTS user_rage_levels (
+                user_id BIGINT PRIMARY KEY,
+                rage_level INTEGER DEFAULT 0,
+                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+            """)
+
+            # Message and response history, partitioned by month
+            await _create_history_tables(connection)
+
+            # Daily statistics rollup, maintained by the interaction statement
+            # (user_id 0 holds the guild-wide totals)
+            await connection.execute("""
+            CREATE TABLE IF NOT EXISTS interaction_stats_daily (
+                guild_id BIGINT NOT NULL,
+                user_id BIGINT NOT NULL,
+                day DATE NOT NULL,
+                personality VARCHAR(50) NOT NULL,
+                mood VARCHAR(50) NOT NULL,
+                interactions INTEGER NOT NULL DEFAULT 0,
+                responses INTEGER NOT NULL DEFAULT 0,
+                latency_ms_total BIGINT NOT NULL DEFAULT 0,
+                peak_rage INTEGER,
+                PRIMARY KEY (guild_id, user_id, day, personality, mood)
+            )
+            """)
+
+            # Conversation exchanges table (persisted conversation history)
+            await connection.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_exchanges (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                user_message TEXT NOT NULL,
+                assistant_message TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+
+            # Index for loading a user's most recent exchanges
+            await connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_conversation_exchanges_user_recent
+            ON conversation_exchanges (user_id, id DESC)
+            """)
+
     try:
-        connection = get_database_connection()
-        cursor = connection.cursor()
-        
-        # Users table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id BIGINT PRIMARY KEY,
-            username VARCHAR(100) NOT NULL,
-            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            interaction_count INTEGER DEFAULT 0
-        )
-        """)
-        
-        # Message history table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS message_history (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            channel_id BIGINT NOT NULL,
-            message_content TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        """)
-        
-        # User rage levels table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_rage_levels (
-            user_id BIGINT PRIMARY KEY,
-            rage_level INTEGER DEFAULT 0,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        """)
-        
-        # Response history table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS response_history (
-            id SERIAL PRIMARY KEY,
-            message_id BIGINT,
-            response_content TEXT,
-            personality VARCHAR(50),
-            mood VARCHAR(50),
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        
-        connection.commit()
+        await _run(create)
         logger.info("Database tables created or already exist")
-        
+
     except Exception as e:
-        if connection:
-            connection.rollback()
         logger.error(f"Error creating tables: {e}")
-        
-    finally:
-        if connection:
-            release_connection(connection)
 
-async def record_user(user_id, username):
+def _add_months(month_start, months):
+    """Move the first day of a month by a number of months"""
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return month_start.replace(year=index // 12, month=index % 12 + 1)
+
+async def _create_history_tables(connection, migrate=False):
+    """
+    Create the partitioned history tables
+
+    Args:
+        connection: Connection inside the table creation transaction
+        migrate (bool): Turn pre-partitioning tables into legacy partitions, otherwise leave them as they are
+
+    Returns:
+        list: History tables still waiting for the migration
     """
-    Record or update user information
-    
+    unmigrated = []
+    for table, create_sql in HISTORY_TABLES.items():
+        if not migrate and await connection.fetchval(TABLE_KIND_SQL, table) == 'r':
+            unmigrated.append(table)
+            continue
+
+        legacy_upper = await _detach_legacy_table(connection, table)
+
+        await connection.execute(f"CREATE SEQUENCE IF NOT EXISTS {table}_id_seq AS BIGINT")
+        await connection.execute(create_sql)
+
+        if legacy_upper is not None:
+            await connection.execute(
+                f"ALTER TABLE {table} ATTACH PARTITION {table}_legacy FOR VALUES FROM (MINVALUE) TO ('{legacy_upper}')"
+            )
+            logger.info(f"Migrated {table} to monthly partitions, existing rows kept in {table}_legacy")
+
+    if unmigrated:
+        logger.warning(
+            f"{', '.join(unmigrated)} not partitioned yet, run Migrate_history.py during a quiet period to migrate"
+        )
+        return unmigrated
+
+    for index_sql in HISTORY_INDEXES:
+        await connection.execute(index_sql)
+
+    await _maintain_partitions(connection)
+    return unmigrated
+
+async def _detach_legacy_table(connection, table):
+    """
+    Prepare a pre-partitioning heap table to become the legacy partition of its replacement
+
+    Widening the ID column rewrites the whole table under an ACCESS EXCLUSIVE
+    lock, so this only runs from migrate_legacy_history(), never at startup.
+
     Args:
-        user_id (int): Discord user ID
-        username (str): Discord username
-        
+        connection: Connection inside the table creation transaction
+        table (str): History table name
+
+    Returns:
+        datetime: Upper bound for the legacy partition, or None if there is nothing to migrate
+    """
+    if await connection.fetchval(TABLE_KIND_SQL, table) != 'r':
+        return None  # Fresh install, or already partitioned
+
+    legacy = f"{table}_legacy"
+    await connection.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    await connection.execute(f"ALTER INDEX {table}_pkey RENAME TO {legacy}_pkey")
+
+    # The ID sequence keeps numbering the new table and must outlive the legacy one
+    await connection.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+    await connection.execute(f"ALTER SEQUENCE {table}_id_seq AS BIGINT")
+
+    # Partition columns must match the parent: BIGINT IDs and a NOT NULL partition key
+    await connection.execute(f"ALTER TABLE {legacy} ALTER COLUMN id TYPE BIGINT")
+    await connection.execute(f"UPDATE {legacy} SET timestamp = 'epoch' WHERE timestamp IS NULL")
+    await connection.execute(f"ALTER TABLE {legacy} ALTER COLUMN timestamp SET NOT NULL")
+
+    return await connection.fetchval(
+        f"SELECT date_trunc('month', COALESCE(max(timestamp), CURRENT_TIMESTAMP)) + interval '1 month' FROM {legacy}"
+    )
+
+async def _partition_upper_bounds(connection, table):
+    """
+    List a history table's partitions with their upper bounds
+
+    Returns:
+        list: (partition name, upper bound datetime) tuples
+    """
+    bounds = []
+    for row in await connection.fetch(SELECT_PARTITIONS_SQL, table):
+        match = _PARTITION_UPPER_BOUND.search(row['bound'])
+        if match:
+            bounds.append((row['name'], datetime.fromisoformat(match.group(1))))
+    return bounds
+
+async def _maintain_partitions(connection):
+    """
+    Create the upcoming monthly partitions and apply the retention policy
+
+    Args:
+        connection: Connection inside a transaction
+    """
+    this_month = await connection.fetchval("SELECT date_trunc('month', CURRENT_TIMESTAMP)::timestamp")
+    cutoff = _add_months(this_month, -HISTORY_RETENTION_MONTHS)
+
+    for table in HISTORY_TABLES:
+        if await connection.fetchval(TABLE_KIND_SQL, table) != 'p':
+            continue  # Still the pre-partitioning table, see migrate_legacy_history()
+
+        bounds = await _partition_upper_bounds(connection, table)
+
+        # Continue after the newest partition, up to HISTORY_PARTITIONS_AHEAD months out
+        month = max([this_month] + [upper for _, upper in bounds])
+        last = _add_months(this_month, HISTORY_PARTITIONS_AHEAD + 1)
+        while month < last:
+            following = _add_months(month, 1)
+            await connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_p{month:%Y%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month}') TO ('{following}')"
+            )
+            month = following
+
+        if HISTORY_RETENTION_MONTHS <= 0:
+            continue
+
+        # Partitions entirely older than the retention window are dropped or detached for archiving
+        for name, upper in bounds:
+            if upper > cutoff:
+                continue
+            if HISTORY_RETENTION_ACTION == 'drop':
+                await connection.execute(f"DROP TABLE {name}")
+                logger.info(f"Dropped history partition {name}")
+            else:
+                await connection.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                logger.info(f"Detached history partition {name} for archiving")
+
+async def migrate_legacy_history():
+    """
+    Migrate pre-partitioning history tables to monthly partitions (one-time step)
+
+    The old tables are rewritten while locked, blocking interaction writes
+    until the migration commits, so run it while the bot is stopped or quiet.
+
     Returns:
         bool: Success or failure
     """
-    connection = None
-    
+    async def migrate(connection):
+        async with connection.transaction():
+            await _create_history_tables(connection, migrate=True)
+
     try:
-        connection = get_database_connection()
-        cursor = connection.cursor()
-        
-        cursor.execute("""
-        INSERT INTO users (user_id, username)
-        VALUES (%s, %s)
-        ON CONFLICT (user_id) 
-        DO UPDATE SET 
-            username = %s,
-            last_seen = CURRENT_TIMESTAMP,
-            interaction_count = users.interaction_count + 1
-        """, (user_id, username, username))
-        
-        connection.commit()
+        await _run(migrate)
         return True
-        
+
     except Exception as e:
-        if connection:
-            connection.rollback()
-        logger.error(f"Error recording user: {e}")
+        logger.error(f"Error migrating history tables: {e}")
         return False
-        
-    finally:
-        if connection:
-            release_connection(connection)
 
-async def record_message(user_id, channel_id, message_content):
+async def run_history_maintenance():
     """
-    Record a message in the database
-    
-    Args:
-        user_id (int): Discord user ID
-        channel_id (int): Discord channel ID
-        message_content (str): Content of the message
-        
+    Create upcoming history partitions and apply the retention policy
+
+    Returns:
+        bool: Success or failure
+    """
+    async def maintain(connection):
+        async with connection.transaction():
+            await _maintain_partitions(connection)
+
+    try:
+        await _run(maintain)
+        return True
+
+    except Exception as e:
+        logger.error(f"Error maintaining history partitions: {e}")
+        return False
+
+async def database_available():
+    """
+    Check whether the database answers a trivial query
+
+    Returns:
+        bool: True if it does
+    """
+    try:
+        await _run(lambda connection: connection.fetchval("SELECT 1"))
+        return True
+
+    except Exception as e:
+        logger.warning(f"Database unavailable: {e}")
+        return False
+
+async def load_rage_levels():
+    """
+    Load every stored non-zero rage level
+
     Returns:
-        int: Message ID or None on failure
+        list: (user_id, rage_level, seconds_since_last_updated) tuples, or None on failure
     """
-    connection = None
-    
     try:
-        connection = get_database_connection()
-        cursor = connection.cursor()
-        
-        cursor.execute("""
-        INSERT INTO message_history (user_id, channel_id, message_content)
-        VALUES (%s, %s, %s)
-        RETURNING id
-        """, (user_id, channel_id, message_content))
-        
-        message_id = cursor.fetchone()[0]
-        connection.commit()
-        return message_id
-        
+        rows = await _run(lambda connection: connection.fetch(SELECT_RAGE_LEVELS_SQL))
+        return [(row['user_id'], row['rage_level'], row['seconds_ago']) for row in rows]
+
     except Exception as e:
-        if connection:
-            connection.rollback()
-        logger.error(f"Error recording message: {e}")
+        logger.error(f"Error loading rage levels: {e}")
         return None
-        
-    finally:
-        if connection:
-            release_connection(connection)
 
-async def update_rage_level(user_id, change):
+async def record_interactions(interactions):
     """
-    Update a user's rage level
-    
+    Record a batch of interactions in a single statement and transaction
+
     Args:
-        user_id (int): Discord user ID
-        change (int): Amount to change the rage level by
-        
+        interactions (list): (user_id, username, guild_id, channel_id, message_content, response_content,
+            personality, mood, rage_level, latency_ms, write_user) tuples. message_content None records
+            only the user, response_content None records no response, rage_level None leaves rage
+            untouched, and the user row is only upserted when write_user is set.
+
     Returns:
-        int: New rage level or None on failure
+        bool: Success or failure
     """
-    connection = None
-    
+    columns = list(zip(*interactions))
+
     try:
-        connection = get_database_connection()
-        cursor = connection.cursor()
-        
-        # First ensure user exists in users table
-        cursor.execute("""
-        SELECT COUNT(*) FROM users WHERE user_id = %s
-        """, (user_id,))
-        
-        if cursor.fetchone()[0] == 0:
-            logger.warning(f"User {user_id} not found when updating rage level")
-            return None
-        
-        # Update or insert rage level
-        cursor.execute("""
-        INSERT INTO user_rage_levels (user_id, rage_level, last_updated)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (user_id) 
-        DO UPDATE SET 
-            rage_level = GREATEST(0, LEAST(100, user_rage_levels.rage_level + %s)),
-            last_updated = CURRENT_TIMESTAMP
-        RETURNING rage_level
-        """, (user_id, max(0, min(100, change)), change))
-        
-        new_level = cursor.fetchone()[0]
-        connection.commit()
-        return new_level
-        
+        await _run(lambda connection: connection.execute(RECORD_INTERACTIONS_SQL, *columns))
+        return True
+
     except Exception as e:
-        if connection:
-            connection.rollback()
-        logger.error(f"Error updating rage level: {e}")
-        return None
-        
-    finally:
-        if connection:
-            release_connection(connection)
+        logger.error(f"Error recording interactions: {e}")
+        return False
 
-async def get_rage_level(user_id):
+async def record_user_activity(activity):
     """
-    Get a user's current rage level
-    
+    Apply coalesced interaction counts and last-seen times in one statement
+
     Args:
-        user_id (int): Discord user ID
-        
+        activity (list): (user_id, interactions, seconds_since_last_seen) tuples
+
+    Returns:
+        bool: Success or failure
+    """
+    columns = list(zip(*activity))
+
+    try:
+        await _run(lambda connection: connection.execute(UPDATE_USER_ACTIVITY_SQL, *columns))
+        return True
+
+    except Exception as e:
+        logger.error(f"Error recording user activity: {e}")
+        return False
+
+async def get_interaction_stats(guild_id, user_id=0, days=30):
+    """
+    Read a user's (or a whole guild's) statistics from the daily rollup
+
+    Args:
+        guild_id (int): Discord guild ID
+        user_id (int): Discord user ID, 0 for the guild-wide totals
+        days (int): Number of days to cover, today included
+
     Returns:
-        int: Current rage level (0-100) or 0 if not found
+        dict: Interactions, responses, average latency, personality and mood counts and
+            daily peak rage, or None on failure
     """
-    connection = None
-    
     try:
-        connection = get_database_connection()
-        cursor = connection.cursor()
-        
-        cursor.execute("""
-        SELECT rage_level FROM user_rage_levels WHERE user_id = %s
-        """, (user_id,))
-        
-        result = cursor.fetchone()
-        if result:
-            return result[0]
-        else:
-            return 0
-            
+        rows = await _run(lambda connection: connection.fetch(SELECT_INTERACTION_STATS_SQL, guild_id, user_id, days))
+
     except Exception as e:
-        logger.error(f"Error getting rage level: {e}")
-        return 0
-        
-    finally:
-        if connection:
-            release_connection(connection)
+        logger.error(f"Error reading interaction stats: {e}")
+        return None
 
-async def record_response(message_id, response_content, personality, mood):
+    stats = {
+        "interactions": 0,
+        "responses": 0,
+        "average_latency_ms": 0,
+        "personalities": {},
+        "moods": {},
+        "peak_rage": {}
+    }
+    latency_total = 0
+    for row in rows:
+        stats["interactions"] += row['interactions']
+        stats["responses"] += row['responses']
+        latency_total += row['latency_ms_total']
+        stats["personalities"][row['personality']] = stats["personalities"].get(row['personality'], 0) + row['interactions']
+        stats["moods"][row['mood']] = stats["moods"].get(row['mood'], 0) + row['interactions']
+        if row['peak_rage'] is not None:
+            stats["peak_rage"][row['day']] = max(stats["peak_rage"].get(row['day'], 0), row['peak_rage'])
+
+    if stats["responses"]:
+        stats["average_latency_ms"] = round(latency_total / stats["responses"])
+    return stats
+
+async def save_exchanges(exchanges):
     """
-    Record a bot response
-    
+    Persist a batch of conversation exchanges with a single COPY
+
     Args:
-        message_id (int): ID of the message being responded to
-        response_content (str): Content of the response
-        personality (str): Active personality that generated the response
-        mood (str): Current mood when response was generated
-        
+        exchanges (list): (user_id, user_message, assistant_message) tuples
+
     Returns:
         bool: Success or failure
     """
-    connection = None
-    
     try:
-        connection = get_database_connection()
-        cursor = connection.cursor()
-        
-        cursor.execute("""
-        INSERT INTO response_history (message_id, response_content, personality, mood)
-        VALUES (%s, %s, %s, %s)
-        """, (message_id, response_content, personality, mood))
-        
-        connection.commit()
+        await _run(lambda connection: connection.copy_records_to_table(
+            'conversation_exchanges',
+            records=exchanges,
+            columns=['user_id', 'user_message', 'assistant_message']
+        ))
         return True
-        
+
     except Exception as e:
-        if connection:
-            connection.rollback()
-        logger.error(f"Error recording response: {e}")
+        logger.error(f"Error saving conversation exchanges: {e}")
         return False
-        
-    finally:
-        if connection:
-            release_connection(connection)
+
+async def load_recent_exchanges(user_id, limit):
+    """
+    Load a user's most recent conversation exchanges
+
+    Args:
+        user_id (int): Discord user ID
+        limit (int): Maximum number of exchanges to load
+
+    Returns:
+        list: (user_message, assistant_message) tuples, oldest first, or None on failure
+    """
+    try:
+        rows = await _run(lambda connection: connection.fetch(SELECT_RECENT_EXCHANGES_SQL, user_id, limit))
+        return [(row['user_message'], row['assistant_message']) for row in reversed(rows)]
+
+    except Exception as e:
+        logger.error(f"Error loading conversation exchanges: {e}")
+        return None
@@ -0,0 +1,187 @@
+# Generation Quotas Module for Marcus Discord Bot
+# Per-user and per-guild token buckets in front of every model generation
+
+import os
+import time
+import logging
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.quotas')
+
+# Load environment variables
+load_dotenv()
+QUOTA_PASSIVE_USER_PER_MINUTE = float(os.getenv('QUOTA_PASSIVE_USER_PER_MINUTE', '6'))
+QUOTA_PASSIVE_USER_BURST = float(os.getenv('QUOTA_PASSIVE_USER_BURST', '3'))
+QUOTA_PASSIVE_GUILD_PER_MINUTE = float(os.getenv('QUOTA_PASSIVE_GUILD_PER_MINUTE', '60'))
+QUOTA_PASSIVE_GUILD_BURST = float(os.getenv('QUOTA_PASSIVE_GUILD_BURST', '20'))
+QUOTA_COMMAND_USER_PER_MINUTE = float(os.getenv('QUOTA_COMMAND_USER_PER_MINUTE', '10'))
+QUOTA_COMMAND_USER_BURST = float(os.getenv('QUOTA_COMMAND_USER_BURST', '5'))
+QUOTA_COMMAND_GUILD_PER_MINUTE = float(os.getenv('QUOTA_COMMAND_GUILD_PER_MINUTE', '120'))
+QUOTA_COMMAND_GUILD_BURST = float(os.getenv('QUOTA_COMMAND_GUILD_BURST', '30'))
+
+# Trigger kinds with separate buckets
+PASSIVE = "passive"  # Mentions, name in message, replies to Marcus
+COMMAND = "command"  # Slash commands
+
+# Seconds between sweeps of buckets that have refilled
+PRUNE_INTERVAL = 60
+
+class TokenBuckets:
+    """
+    Token buckets keyed by ID, refilled lazily when they are read.
+
+    Only buckets that are below full are stored; a full bucket is the same as
+    no entry, so refilled ones are dropped by a periodic sweep and memory stays
+    proportional to the users and guilds active within the refill time.
+    """
+
+    def __init__(self, per_minute, burst):
+        """
+        Initialize the buckets
+
+        Args:
+            per_minute (float): Tokens added per minute (0 disables the limit)
+            burst (float): Bucket capacity, the most requests allowed back to back
+        """
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._buckets = {}  # key -> (tokens, time.monotonic() of last update)
+
+    @property
+    def enabled(self):
+        """Whether this limit applies at all"""
+        return self.rate > 0 and self.burst > 0
+
+    def level(self, key, now):
+        """
+        Get the tokens currently in a bucket
+
+        Args:
+            key (int): User or guild ID
+            now (float): Current time.monotonic()
+
+        Returns:
+            float: Tokens available
+        """
+        state = self._buckets.get(key)
+        if state is None:
+            return self.burst
+        tokens, updated = state
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def set(self, key, tokens, now):
+        """
+        Store a bucket's level
+
+        Args:
+            key (int): User or guild ID
+            tokens (float): Tokens left
+            now (float): Current time.monotonic()
+        """
+        self._buckets[key] = (tokens, now)
+
+    def prune(self, now):
+        """
+        Drop buckets that have refilled completely
+
+        Args:
+            now (float): Current time.monotonic()
+        """
+        full = [key for key in self._buckets if self.level(key, now) >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class GenerationQuotas:
+    """
+    Rate limits on model generation per user and per guild.
+
+    Passive triggers and slash commands draw from separate buckets, so
+    chatting doesn't use up someone's commands. A request goes through only
+    if both its user bucket and its guild bucket have a token, and then
+    takes one from each.
+    """
+
+    def __init__(self):
+        """Initialize the buckets from config"""
+        self._buckets = {
+            PASSIVE: (
+                TokenBuckets(QUOTA_PASSIVE_USER_PER_MINUTE, QUOTA_PASSIVE_USER_BURST),
+                TokenBuckets(QUOTA_PASSIVE_GUILD_PER_MINUTE, QUOTA_PASSIVE_GUILD_BURST)
+            ),
+            COMMAND: (
+                TokenBuckets(QUOTA_COMMAND_USER_PER_MINUTE, QUOTA_COMMAND_USER_BURST),
+                TokenBuckets(QUOTA_COMMAND_GUILD_PER_MINUTE, QUOTA_COMMAND_GUILD_BURST)
+            )
+        }
+        self._last_prune = time.monotonic()
+
+        # Counters for observability
+        self.allowed = {PASSIVE: 0, COMMAND: 0}
+        self.throttled = {PASSIVE: 0, COMMAND: 0}
+
+    def allow(self, kind, user_id, guild_id=None):
+        """
+        Take a generation token for a user and their guild
+
+        Args:
+            kind (str): PASSIVE or COMMAND
+            user_id (int): Discord user ID
+            guild_id (int, optional): Discord guild ID, None for direct messages
+
+        Returns:
+            bool: True if the request may generate, False if it is throttled
+        """
+        now = time.monotonic()
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._prune(now)
+
+        user_buckets, guild_buckets = self._buckets[kind]
+        checks = [(user_buckets, user_id)]
+        if guild_id is not None:
+            checks.append((guild_buckets, guild_id))
+
+        levels = []
+        for buckets, key in checks:
+            if not buckets.enabled:
+                continue
+            tokens = buckets.level(key, now)
+            if tokens < 1:
+                self.throttled[kind] += 1
+                return False
+            levels.append((buckets, key, tokens))
+
+        for buckets, key, tokens in levels:
+            buckets.set(key, tokens - 1, now)
+        self.allowed[kind] += 1
+        return True
+
+    def _prune(self, now):
+        """Drop refilled buckets everywhere"""
+        self._last_prune = now
+        for user_buckets, guild_buckets in self._buckets.values():
+            user_buckets.prune(now)
+            guild_buckets.prune(now)
+
+    def get_stats(self):
+        """
+        Get quota counters
+
+        Returns:
+            dict: Allowed and throttled requests and tracked buckets per trigger kind
+        """
+        return {
+            kind: {
+                "allowed": self.allowed[kind],
+                "throttled": self.throttled[kind],
+                "tracked_users": len(user_buckets),
+                "tracked_guilds": len(guild_buckets)
+            }
+            for kind, (user_buckets, guild_buckets) in self._buckets.items()
+        }
+
+# Shared quotas used by the bot and its commands
+generation_quotas = GenerationQuotas()
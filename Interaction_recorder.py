@@ -0,0 +1,332 @@
+# Interaction Recorder Module for Marcus Discord Bot
+# Buffers interactions and writes them behind in batches
+
+import os
+import time
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+from Database_connection import record_interactions, record_user_activity, database_available
+from User_cache import user_cache
+
+# Configure logging
+logger = logging.getLogger('marcus.recorder')
+
+# Load environment variables
+load_dotenv()
+DB_RECORD_FLUSH_INTERVAL = float(os.getenv('DB_RECORD_FLUSH_INTERVAL', '2'))
+DB_RECORD_BATCH_SIZE = int(os.getenv('DB_RECORD_BATCH_SIZE', '200'))
+DB_RECORD_MAX_PENDING = int(os.getenv('DB_RECORD_MAX_PENDING', '10000'))
+USER_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('USER_ACTIVITY_FLUSH_INTERVAL', '60'))
+
+# Longest wait between attempts to write interactions while the database is unreachable
+FLUSH_RETRY_MAX_DELAY = 60
+
+class InteractionRecorder:
+    """
+    Write-behind recorder for interactions.
+
+    Recording is synchronous and never touches the database: an interaction
+    (user, message, response and optional new rage level) is queued in memory
+    and a background flush writes the whole batch with one statement in one
+    transaction, once the batch is full or the flush interval has passed.
+
+    The users row is only written for a user the user cache doesn't know
+    yet or whose username changed. For known users, interaction counts and
+    last-seen times accumulate in memory and are applied in bulk on a
+    longer interval, so busy users don't touch their row on every message.
+    Failed writes are kept and retried with backoff. A batch that fails
+    again while the database is reachable is written in halves, so rows the
+    database rejects are found and dropped instead of blocking the rest.
+    """
+
+    def __init__(self, flush_interval=DB_RECORD_FLUSH_INTERVAL, batch_size=DB_RECORD_BATCH_SIZE,
+                 max_pending=DB_RECORD_MAX_PENDING, activity_flush_interval=USER_ACTIVITY_FLUSH_INTERVAL):
+        """
+        Initialize the recorder
+
+        Args:
+            flush_interval (float): Seconds a recorded interaction may wait before being written
+            batch_size (int): Write immediately once this many interactions are waiting
+            max_pending (int): Interactions kept while the database is unreachable, oldest dropped first
+            activity_flush_interval (float): Seconds between bulk updates of known users' counters
+        """
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.activity_flush_interval = activity_flush_interval
+
+        self._pending = []  # Argument tuples for record_interactions
+        self._flush_task = None
+        self._flushing = set()
+        self._flush_lock = asyncio.Lock()
+        self._retry_delay = flush_interval
+        self._consecutive_failures = 0
+        self._closed = False
+
+        self._activity = {}  # user_id -> [interactions, last seen (monotonic)]
+        self._activity_task = None
+
+        # Counters for observability
+        self.activity_flushes = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def record_interaction(self, user_id, username, channel_id, message_content=None, response_content=None,
+                           personality="default", mood="neutral", rage_level=None, guild_id=None, started_at=None):
+        """
+        Record an interaction with Marcus
+
+        Args:
+            user_id (int): Discord user ID
+            username (str): Discord username
+            channel_id (int): Discord channel ID
+            message_content (str, optional): Content of the message, None records only the user
+            response_content (str, optional): Content of the response, None if Marcus didn't answer
+            personality (str): Active personality that generated the response
+            mood (str): Current mood when response was generated
+            rage_level (int, optional): The user's new rage level, from the rage tracker
+            guild_id (int, optional): Discord guild ID, None for direct messages
+            started_at (float, optional): time.monotonic() when the trigger arrived, for response latency
+        """
+        latency_ms = round((time.monotonic() - started_at) * 1000) if started_at is not None else None
+
+        # Only new or renamed users need their row written, known users just count
+        write_user = not user_cache.is_current(user_id, username)
+        if write_user:
+            user_cache.remember(user_id, username)
+        else:
+            activity = self._activity.setdefault(user_id, [0, 0.0])
+            activity[0] += 1
+            activity[1] = time.monotonic()
+            if self._activity_task is None or self._activity_task.done():
+                self._activity_task = asyncio.create_task(self._flush_activity_after(self.activity_flush_interval))
+
+        self._pending.append(
+            (user_id, username, guild_id or 0, channel_id, message_content, response_content, personality, mood,
+             rage_level, latency_ms, write_user)
+        )
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Write pending interactions now if the batch is full, otherwise after the interval"""
+        if len(self._pending) >= self.batch_size and not self._flushing:
+            task = asyncio.create_task(self.flush())
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after(self.flush_interval))
+
+    async def _flush_after(self, delay):
+        """Wait, then write everything pending"""
+        await asyncio.sleep(delay)
+
+        # The timer has fired: rows recorded from now on arm a new one, and close()
+        # waits for this flush instead of cancelling it halfway through a write
+        self._flush_task = None
+        self._track_flush()
+        await self.flush()
+
+    def _track_flush(self):
+        """Count the running task as an in-flight flush that close() waits for"""
+        task = asyncio.current_task()
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def flush(self):
+        """
+        Write every pending interaction in one statement
+
+        Returns:
+            bool: True if nothing was left unwritten
+        """
+        # One batch at a time, so batches land in the order they were recorded
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+
+            batch, self._pending = self._pending, []
+            if await record_interactions(batch):
+                self.flushes += 1
+                self.written += len(batch)
+                self._consecutive_failures = 0
+                self._retry_delay = self.flush_interval
+                return True
+
+            self.failed_flushes += 1
+            unwritten, rejected = batch, []
+
+            # Failing again while the database answers: a row in the batch is rejected, find it
+            if self._consecutive_failures and await database_available():
+                written, unwritten, rejected = await self._isolate(batch)
+                self.written += written
+                if rejected:
+                    self.rejected += len(rejected)
+                    logger.error(f"Database rejected {len(rejected)} interactions, dropped them")
+
+            # Keep the rest for the next attempt, dropping the oldest past the cap
+            self._pending = unwritten + self._pending
+            dropped = []
+            if len(self._pending) > self.max_pending:
+                dropped = self._pending[:len(self._pending) - self.max_pending]
+                self._pending = self._pending[len(dropped):]
+                self.dropped += len(dropped)
+                logger.warning(f"Interaction backlog over {self.max_pending}, dropped the oldest {len(dropped)}")
+            self._discard(rejected + dropped)
+
+            if not unwritten:
+                self._consecutive_failures = 0
+                self._retry_delay = self.flush_interval
+                return True
+
+            self._consecutive_failures += 1
+            self._retry_later()
+            return False
+
+    async def _isolate(self, rows):
+        """
+        Write a failed batch in halves down to single rows, so rows the database rejects don't hold back the rest
+
+        Args:
+            rows (list): Interactions that failed to write together
+
+        Returns:
+            tuple: (number written, rows left for a later attempt, rows rejected by the database)
+        """
+        if len(rows) == 1:
+            # A single row failing against a reachable database is rejected by it, not an outage
+            if await database_available():
+                return 0, [], rows
+            return 0, rows, []
+
+        written, unwritten, rejected = 0, [], []
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            if unwritten:
+                unwritten += half  # The database went away, keep the rest for later
+            elif await record_interactions(half):
+                written += len(half)
+            else:
+                half_written, half_unwritten, half_rejected = await self._isolate(half)
+                written += half_written
+                unwritten += half_unwritten
+                rejected += half_rejected
+        return written, unwritten, rejected
+
+    def _discard(self, rows):
+        """
+        Account for interactions that will never be written
+
+        A dropped row may have been the only one writing its user's row. Another
+        pending row of that user takes over the write, otherwise the user is
+        forgotten by the cache so their next interaction writes it.
+
+        Args:
+            rows (list): Interactions dropped from the queue
+        """
+        for interaction in rows:
+            if not interaction[-1]:
+                continue
+
+            user_id = interaction[0]
+            for index, pending in enumerate(self._pending):
+                if pending[0] != user_id:
+                    continue
+                if not pending[-1]:
+                    self._pending[index] = pending[:-1] + (True,)
+                    activity = self._activity.get(user_id)
+                    if activity and activity[0] > 0:
+                        activity[0] -= 1  # The user upsert counts this interaction now
+                break
+            else:
+                user_cache.forget(user_id)
+
+    def _retry_later(self):
+        """Try a failed write again after a delay that doubles up to FLUSH_RETRY_MAX_DELAY"""
+        if self._closed:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after(self._retry_delay))
+        self._retry_delay = min(self._retry_delay * 2, FLUSH_RETRY_MAX_DELAY)
+
+    async def _flush_activity_after(self, delay):
+        """Wait, then apply the accumulated user activity"""
+        await asyncio.sleep(delay)
+
+        # Same as _flush_after: close() waits for an update that has started
+        self._activity_task = None
+        self._track_flush()
+        await self.flush_activity()
+
+    async def flush_activity(self):
+        """
+        Apply accumulated interaction counts and last-seen times in one statement
+
+        Returns:
+            bool: True if nothing was left unapplied
+        """
+        if not self._activity:
+            return True
+
+        # Pending interactions may create the rows being updated, write them first
+        if not await self.flush():
+            self._retry_activity_later()
+            return False
+
+        activity, self._activity = self._activity, {}
+        now = time.monotonic()
+        rows = [(user_id, interactions, now - last_seen) for user_id, (interactions, last_seen) in activity.items()]
+        if await record_user_activity(rows):
+            self.activity_flushes += 1
+            return True
+
+        # Merge back with activity recorded while the update ran
+        for user_id, (interactions, last_seen) in activity.items():
+            current = self._activity.setdefault(user_id, [0, last_seen])
+            current[0] += interactions
+        self._retry_activity_later()
+        return False
+
+    def _retry_activity_later(self):
+        """Try a failed activity update again after the next activity interval"""
+        if self._closed:
+            return
+        if self._activity_task is None or self._activity_task.done():
+            self._activity_task = asyncio.create_task(self._flush_activity_after(self.activity_flush_interval))
+
+    async def close(self):
+        """Stop the flush timers, wait for writes in flight and write anything still pending (called on shutdown)"""
+        self._closed = True
+        for task in (self._flush_task, self._activity_task):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+        await self.flush()
+        await self.flush_activity()
+
+    def get_stats(self):
+        """
+        Get recorder counters
+
+        Returns:
+            dict: Pending interactions and user activity, flushes, interactions written, dropped and rejected, user cache
+        """
+        return {
+            "pending": len(self._pending),
+            "pending_activity": len(self._activity),
+            "activity_flushes": self.activity_flushes,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "user_cache": user_cache.get_stats()
+        }
+
+# Shared recorder used by the bot and its commands
+interaction_recorder = InteractionRecorder()
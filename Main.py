@@ -10,14 +10,28 @@ from dotenv import load_dotenv
 import logging
 import asyncio
 import random
+import time
 import sys
 import traceback
 
 # Import custom modules
 from Personality_manager import PersonalityManager
-from Database_connection import initialize_database, record_user, record_message, record_response
-from Ai_connection import get_ai_response
+from Database_connection import initialize_database, close_database
+from Interaction_recorder import interaction_recorder
+from Ai_connection import (get_ai_response, stream_ai_response, get_busy_response, get_throttled_response,
+                           get_generation_stats, conversation_history)
+from Ai_queue import Priority, GenerationRejected, deadline_for
+from Ai_client import close_ai_clients
+from Model_tiers import model_tiers
+from Prompt_builder import prompt_builder
 from Ai_speech import format_speech
+from Message_streamer import STREAM_RESPONSES, stream_reply
+from Reply_pacing import reply_pacer
+from Burst_coalescer import burst_coalescer, format_burst
+from Generation_quotas import PASSIVE, COMMAND, generation_quotas
+from Message_filter import message_filter
+from Response_pool import response_pool
+from Rage_tracker import rage_tracker
 from Mood import MoodSystem
 
 # Set up logging
@@ -35,6 +49,10 @@ logger = logging.getLogger('marcus')
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 GUILD_ID = int(os.getenv('Development_Guild_ID'))
+STATS_LOG_INTERVAL = float(os.getenv('STATS_LOG_INTERVAL', '300'))
+
+# Reaction used when a passive trigger is shed under load
+SHED_REACTION = "\U0001FAB1"  # worm
 
 # Intents setup
 intents = discord.Intents.default()
@@ -44,7 +62,8 @@ intents.members = True
 # Bot setup
 class MarcusBot(commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix='!', intents=intents)
+        # commands.Bot requires a prefix, but on_message never processes prefix commands
+        super().__init__(command_prefix=commands.when_mentioned, intents=intents)
         self.personality_manager = PersonalityManager()
         self.mood_system = MoodSystem()
         
@@ -54,6 +73,11 @@ class MarcusBot(commands.Bot):
         db_success = await initialize_database()
         if not db_success:
             logger.warning("Database initialization had issues, but continuing...")
+        else:
+            await rage_tracker.ensure_loaded()
+        
+        # Load the tokenizer in the background, prompts are estimated by length until it's ready
+        asyncio.get_running_loop().run_in_executor(None, prompt_builder.load_tokenizer)
         
         # Load command cogs
         try:
@@ -63,6 +87,10 @@ class MarcusBot(commands.Bot):
             logger.error(f"Error loading Commands cog: {e}")
             traceback.print_exc()
         
+        # Periodically report generation pipeline health
+        if STATS_LOG_INTERVAL > 0:
+            self.stats_task = asyncio.create_task(self._log_runtime_stats())
+        
         # Register commands
         try:
             logger.info(f"Syncing commands to guild ID: {GUILD_ID}")
@@ -71,6 +99,28 @@ class MarcusBot(commands.Bot):
             logger.error(f"Error syncing commands: {e}")
             traceback.print_exc()
         
+    async def _log_runtime_stats(self):
+        """Log generation pipeline and response pool counters at a fixed interval"""
+        while not self.is_closed():
+            await asyncio.sleep(STATS_LOG_INTERVAL)
+            logger.info(f"Generation stats: {get_generation_stats()}")
+            logger.info(f"Response pool stats: {response_pool.get_stats()}")
+            logger.info(f"Interaction recorder stats: {interaction_recorder.get_stats()}")
+            logger.info(f"Rage tracker stats: {rage_tracker.get_stats()}")
+            logger.info(f"Reply pacing stats: {reply_pacer.get_stats()}")
+            logger.info(f"Burst coalescer stats: {burst_coalescer.get_stats()}")
+            logger.info(f"Generation quota stats: {generation_quotas.get_stats()}")
+            logger.info(f"Message filter stats: {message_filter.get_stats()}")
+        
+    async def close(self):
+        # Save buffered history and interactions, then release the database and model server pools
+        await conversation_history.close()
+        await interaction_recorder.close()
+        await close_database()
+        model_tiers.stop()
+        await close_ai_clients()
+        await super().close()
+        
     async def on_ready(self):
         logger.info(f'{self.user} has connected to Discord!')
         logger.info(f'Bot is connected to {len(self.guilds)} guild(s)')
@@ -82,11 +132,23 @@ bot = MarcusBot()
 @bot.tree.command(name="marcus", description="Interact with Marcus the worm directly")
 @app_commands.describe(message="What do you want to say to Marcus?")
 async def marcus_command(interaction: discord.Interaction, message: str):
+    started_at = time.monotonic()
+    
     # Log the interaction
     logger.info(f"User {interaction.user.name} used /marcus with message: {message}")
     
-    # Record user in database
-    await record_user(interaction.user.id, interaction.user.name)
+    # Over quota: answer in character without touching the model
+    if not generation_quotas.allow(COMMAND, interaction.user.id, interaction.guild_id):
+        logger.info(f"/marcus from {interaction.user.name} throttled")
+        current_mood = bot.mood_system.get_current_mood()
+        ai_response = get_throttled_response()
+        await interaction.response.send_message(format_speech(ai_response, current_mood))
+        interaction_recorder.record_interaction(
+            interaction.user.id, interaction.user.name, interaction.channel_id,
+            message, ai_response, "default", current_mood,
+            guild_id=interaction.guild_id, started_at=started_at
+        )
+        return
     
     # Defer response as AI processing might take time
     await interaction.response.defer(thinking=True)
@@ -96,91 +158,141 @@ async def marcus_command(interaction: discord.Interaction, message: str):
     current_mood = bot.mood_system.get_current_mood()
     
     # Generate response through AI, passing user ID for conversation history
-    ai_response = await get_ai_response(message, current_mood, personality, user_id=interaction.user.id)
-    
-    # Format the response
-    formatted_response = format_speech(ai_response, current_mood)
-    
-    # Record message and response in database
-    message_id = await record_message(interaction.user.id, interaction.channel_id, message)
-    await record_response(message_id, ai_response, personality, current_mood)
+    try:
+        if STREAM_RESPONSES:
+            # Show the response in the followup message while it is being generated
+            ai_response = await stream_reply(
+                lambda content: interaction.followup.send(content, wait=True),
+                stream_ai_response(message, current_mood, personality, user_id=interaction.user.id, use_cache=False,
+                                   command="marcus"),
+                current_mood
+            )
+        else:
+            # /marcus always gets freshly generated text
+            ai_response = await get_ai_response(message, current_mood, personality, user_id=interaction.user.id, use_cache=False,
+                                                command="marcus")
+            
+            # Format and send the response
+            formatted_response = format_speech(ai_response, current_mood)
+            await interaction.followup.send(formatted_response)
+            
+    except GenerationRejected as e:
+        # Model is saturated, answer cheaply instead of waiting
+        logger.info(f"/marcus request from {interaction.user.name} rejected: {e}")
+        ai_response = get_busy_response()
+        await interaction.followup.send(format_speech(ai_response, current_mood))
     
-    # Send response
-    await interaction.followup.send(formatted_response)
+    # Record the user, message and response in database (written behind, never delays the reply)
+    interaction_recorder.record_interaction(
+        interaction.user.id, interaction.user.name, interaction.channel_id,
+        message, ai_response, personality, current_mood,
+        guild_id=interaction.guild_id, started_at=started_at
+    )
 
 # Event for processing messages (to respond to mentions and "Marcus" in messages)
 @bot.event
 async def on_message(message):
-    # Ignore messages from the bot itself
-    if message.author == bot.user:
+    # Cheap staged checks first, almost no message involves Marcus
+    # (prefix commands aren't processed at all, Marcus only has slash commands)
+    trigger = message_filter.triggers(message, bot.user)
+    if trigger is None:
         return
     
-    await bot.process_commands(message)
-    
-    # Check if bot is mentioned or "Marcus" is in the message (case insensitive)
-    mentioned = bot.user in message.mentions
-    name_in_message = "marcus" in message.content.lower()
-    
-    # Check if message is a reply to a message from Marcus
-    is_reply_to_marcus = False
-    if message.reference and message.reference.resolved:
-        if message.reference.resolved.author == bot.user:
-            is_reply_to_marcus = True
-            logger.info(f"Message is a reply to Marcus")
+    started_at = time.monotonic()
+    mentioned, name_in_message, is_reply_to_marcus = trigger
+    if is_reply_to_marcus:
+        logger.info(f"Message is a reply to Marcus")
     
     # Respond if mentioned, name is in message, or replying to Marcus
     if mentioned or name_in_message or is_reply_to_marcus:
         logger.info(f"Message from {message.author.name} triggered Marcus (mentioned: {mentioned}, name: {name_in_message})")
         
-        # Record user and message in database
-        await record_user(message.author.id, message.author.name)
-        message_id = await record_message(message.author.id, message.channel.id, message.content)
-        
-        # Show typing indicator
+        # Show typing indicator until the reply is delivered
         async with message.channel.typing():
-            # Get appropriate personality to respond
-            personality, response_delay = bot.personality_manager.get_responding_personality(message.content)
-            current_mood = bot.mood_system.get_current_mood()
+            # Messages triggering Marcus in the same channel at once get one reply between them
+            burst = await burst_coalescer.collect(message)
+            if burst is None:
+                return
             
-            # Add some random delay to make responses feel more natural
-            await asyncio.sleep(random.uniform(1, response_delay))
+            # Answer the latest message, with the whole burst as what was said
+            reply_to = burst[-1]
+            prompt = format_burst(burst)
             
-            # Get AI response based on personality and mood, with conversation history
-            ai_response = await get_ai_response(
-                message.content, 
-                current_mood,
-                personality=personality,
-                user_id=message.author.id
-            )
+            # Over quota: answer in character without touching the model
+            # (the burst costs one generation, charged to the message being answered)
+            guild_id = reply_to.guild.id if reply_to.guild else None
+            if not generation_quotas.allow(PASSIVE, reply_to.author.id, guild_id):
+                logger.info(f"Burst of {len(burst)} answering {reply_to.author.name} throttled")
+                current_mood = bot.mood_system.get_current_mood()
+                ai_response = get_throttled_response()
+                await reply_to.reply(format_speech(ai_response, current_mood))
+                for burst_message in burst:
+                    answered = burst_message is reply_to
+                    interaction_recorder.record_interaction(
+                        burst_message.author.id, burst_message.author.name, burst_message.channel.id,
+                        burst_message.content, ai_response if answered else None, "default", current_mood,
+                        guild_id=burst_message.guild.id if burst_message.guild else None,
+                        started_at=started_at if burst_message is message else None
+                    )
+                return
             
-            # Format the speech
-            formatted_response = format_speech(ai_response, current_mood)
+            # Interactions outrank replies, replies outrank passive mentions
+            priority = Priority.REPLY if is_reply_to_marcus else Priority.MENTION
+            deadline = deadline_for(priority)
             
-            # Record the response in database
-            await record_response(message_id, ai_response, personality, current_mood)
+            # Get appropriate personality to respond
+            personality, response_delay = bot.personality_manager.get_responding_personality(prompt)
+            current_mood = bot.mood_system.get_current_mood()
             
-            # Send the response
-            await message.reply(formatted_response)
-
-# Error handling for command errors
-@bot.event
-async def on_command_error(ctx, error):
-    if isinstance(error, commands.CommandNotFound):
-        return  # Ignore command not found errors
-    
-    logger.error(f"Command error: {error}")
-    
-    # Send error message to user
-    try:
-        current_mood = bot.mood_system.get_current_mood()
-        if current_mood == "glitchy":
-            error_msg = "E̷r̵r̸o̵r̷ d̶e̶t̸e̵c̸t̸e̴d̶. C̵a̷n̸n̷o̷t̴ p̷r̴o̷c̷e̷s̷s̶ c̷o̸m̸m̷a̴n̴d̸."
-        else:
-            error_msg = "I cannot process that command. My abilities are... limited."
-        
-        await ctx.send(format_speech(error_msg, current_mood))
-    except Exception:
-        pass
+            # The natural-feeling delay is a minimum time-to-reply, generation runs during it
+            pace = reply_pacer.start(random.uniform(1, response_delay), started_at)
+            
+            try:
+                if STREAM_RESPONSES:
+                    # Stream the reply into Discord as it is generated
+                    ai_response = await stream_reply(
+                        pace.wrap(reply_to.reply),
+                        stream_ai_response(
+                            prompt,
+                            current_mood,
+                            personality=personality,
+                            user_id=reply_to.author.id,
+                            priority=priority,
+                            deadline=deadline
+                        ),
+                        current_mood
+                    )
+                else:
+                    # Get AI response based on personality and mood, with conversation history
+                    ai_response = await get_ai_response(
+                        prompt, 
+                        current_mood,
+                        personality=personality,
+                        user_id=reply_to.author.id,
+                        priority=priority,
+                        deadline=deadline
+                    )
+                    
+                    # Format the speech and send the response once the delay is up
+                    formatted_response = format_speech(ai_response, current_mood)
+                    await pace.wait()
+                    await reply_to.reply(formatted_response)
+                    
+            except GenerationRejected as e:
+                # Shed or stale: acknowledge with a reaction instead of a model call
+                logger.info(f"Message from {reply_to.author.name} not answered: {e}")
+                ai_response = None
+                await reply_to.add_reaction(SHED_REACTION)
+                
+            # Record every message of the burst, the response goes with the one it replied to
+            for burst_message in burst:
+                answered = burst_message is reply_to
+                interaction_recorder.record_interaction(
+                    burst_message.author.id, burst_message.author.name, burst_message.channel.id,
+                    burst_message.content, ai_response if answered else None, personality, current_mood,
+                    guild_id=burst_message.guild.id if burst_message.guild else None,
+                    started_at=started_at if burst_message is message else None
+                )
 
 # Run the bot
 if __name__ == "__main__":
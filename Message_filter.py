@@ -0,0 +1,137 @@
+# Message Filter Module for Marcus Discord Bot
+# Cheap staged checks that drop messages which can't trigger Marcus before any real work
+
+import os
+import re
+import logging
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.message_filter')
+
+def _id_set(name):
+    """Read a comma-separated list of Discord IDs from the environment"""
+    return frozenset(int(value) for value in (os.getenv(name) or '').split(',') if value.strip())
+
+# Load environment variables
+load_dotenv()
+MARCUS_ALLOWED_GUILDS = _id_set('MARCUS_ALLOWED_GUILDS')
+MARCUS_DENIED_GUILDS = _id_set('MARCUS_DENIED_GUILDS')
+MARCUS_ALLOWED_CHANNELS = _id_set('MARCUS_ALLOWED_CHANNELS')
+MARCUS_DENIED_CHANNELS = _id_set('MARCUS_DENIED_CHANNELS')
+
+# Name that triggers Marcus anywhere in a message, matched without a lowered copy of the message
+NAME_PATTERN = re.compile('marcus', re.IGNORECASE)
+
+# Rejection stages, in the order they run
+SCOPE = "scope"        # Guild or channel not served
+OWN = "own"            # Marcus's own messages
+NO_TRIGGER = "no_trigger"  # No mention, name or reply to Marcus
+
+class MessageFilter:
+    """
+    Staged ingress checks for on_message.
+
+    Every message in every visible channel goes through here, so each stage
+    is cheaper than the next: set lookups on guild and channel IDs, then an
+    identity check on the author, then trigger detection without copying the
+    message. Rejections are counted per stage.
+    """
+
+    def __init__(self, allowed_guilds=MARCUS_ALLOWED_GUILDS, denied_guilds=MARCUS_DENIED_GUILDS,
+                 allowed_channels=MARCUS_ALLOWED_CHANNELS, denied_channels=MARCUS_DENIED_CHANNELS):
+        """
+        Initialize the filter
+
+        Args:
+            allowed_guilds (frozenset): Guild IDs served, empty for all (direct messages are
+                                        not served while this is set)
+            denied_guilds (frozenset): Guild IDs never served
+            allowed_channels (frozenset): Channel IDs served, empty for all
+            denied_channels (frozenset): Channel IDs never served
+        """
+        self.allowed_guilds = allowed_guilds
+        self.denied_guilds = denied_guilds
+        self.allowed_channels = allowed_channels
+        self.denied_channels = denied_channels
+
+        # Counters for observability
+        self.seen = 0
+        self.passed = 0
+        self.rejected = {SCOPE: 0, OWN: 0, NO_TRIGGER: 0}
+
+    def in_scope(self, guild_id, channel_id):
+        """
+        Check the guild and channel against the allow and deny lists
+
+        Args:
+            guild_id (int, optional): Discord guild ID, None for direct messages
+            channel_id (int): Discord channel ID
+
+        Returns:
+            bool: True if Marcus may answer there
+        """
+        if channel_id in self.denied_channels or guild_id in self.denied_guilds:
+            return False
+        if self.allowed_channels and channel_id not in self.allowed_channels:
+            return False
+        if self.allowed_guilds and guild_id not in self.allowed_guilds:
+            return False
+        return True
+
+    def triggers(self, message, bot_user):
+        """
+        Run the stages on a message
+
+        Args:
+            message (discord.Message): Incoming message
+            bot_user (discord.ClientUser): Marcus's own user
+
+        Returns:
+            tuple: (mentioned, name_in_message, is_reply_to_marcus) if the message triggers Marcus, otherwise None
+        """
+        self.seen += 1
+
+        # Stage 1: guilds and channels Marcus doesn't serve
+        guild = message.guild
+        if not self.in_scope(guild.id if guild else None, message.channel.id):
+            self.rejected[SCOPE] += 1
+            return None
+
+        # Stage 2: Marcus's own messages
+        if message.author.id == bot_user.id:
+            self.rejected[OWN] += 1
+            return None
+
+        # Stage 3: mentions, the name anywhere (case insensitive), or a reply to Marcus
+        mentioned = bool(message.mentions) and bot_user in message.mentions
+        name_in_message = NAME_PATTERN.search(message.content) is not None
+
+        is_reply_to_marcus = False
+        reference = message.reference
+        if reference is not None and reference.resolved is not None:
+            # A deleted referenced message has no author
+            is_reply_to_marcus = getattr(reference.resolved, 'author', None) == bot_user
+
+        if not (mentioned or name_in_message or is_reply_to_marcus):
+            self.rejected[NO_TRIGGER] += 1
+            return None
+
+        self.passed += 1
+        return mentioned, name_in_message, is_reply_to_marcus
+
+    def get_stats(self):
+        """
+        Get filter counters
+
+        Returns:
+            dict: Messages seen, passed and rejected per stage
+        """
+        return {
+            "seen": self.seen,
+            "passed": self.passed,
+            "rejected": dict(self.rejected)
+        }
+
+# Shared filter used by on_message
+message_filter = MessageFilter()
@@ -0,0 +1,74 @@
+# Message Streaming Module for Marcus Discord Bot
+# Pushes streamed AI text into a Discord message as throttled edits
+
+import os
+import time
+import logging
+import discord
+from dotenv import load_dotenv
+
+from Ai_speech import format_speech
+
+# Configure logging
+logger = logging.getLogger('marcus.streaming')
+
+# Load environment variables
+load_dotenv()
+STREAM_RESPONSES = os.getenv('AI_STREAM_RESPONSES', 'false').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('AI_STREAM_EDIT_INTERVAL', '1.0'))
+
+# Discord rejects message content longer than this
+DISCORD_MESSAGE_LIMIT = 2000
+
+async def stream_reply(send, chunks, mood="neutral", edit_interval=STREAM_EDIT_INTERVAL):
+    """
+    Show a streamed response in Discord as it is generated
+
+    The first visible text is sent straight away, later text is pushed as
+    edits no more often than edit_interval, and the final edit replaces the
+    message with the fully formatted response.
+
+    Args:
+        send (callable): Coroutine function taking the content and returning the sent message
+                         (e.g. message.reply or interaction.followup.send)
+        chunks (async iterator): Visible text pieces, as yielded by stream_ai_response
+        mood (str): Current mood of Marcus, used to format the final text
+        edit_interval (float): Minimum seconds between edits
+
+    Returns:
+        str: The complete unformatted response text
+    """
+    message = None
+    parts = []
+    shown = ""
+    last_edit = 0.0
+
+    async for chunk in chunks:
+        parts.append(chunk)
+        text = ''.join(parts).strip()[:DISCORD_MESSAGE_LIMIT]
+        if not text:
+            continue
+
+        now = time.monotonic()
+        try:
+            if message is None:
+                message = await send(text)
+                shown = text
+                last_edit = now
+            elif now - last_edit >= edit_interval and text != shown:
+                await message.edit(content=text)
+                shown = text
+                last_edit = now
+        except discord.HTTPException as e:
+            # A dropped intermediate edit is fine, the final edit catches up
+            logger.warning(f"Failed to update streamed message: {e}")
+
+    full_text = ''.join(parts)
+    final_text = format_speech(full_text, mood)[:DISCORD_MESSAGE_LIMIT]
+
+    if message is None:
+        await send(final_text)
+    elif final_text != shown:
+        await message.edit(content=final_text)
+
+    return full_text
@@ -0,0 +1,27 @@
+# History Migration for Marcus Discord Bot
+# One-time move of pre-partitioning message and response history to monthly partitions
+
+import sys
+import asyncio
+import logging
+
+from Database_connection import initialize_database, migrate_legacy_history, close_database
+
+async def main():
+    if not await initialize_database():
+        return 1
+
+    try:
+        if not await migrate_legacy_history():
+            return 1
+        print("History tables are partitioned")
+        return 0
+    finally:
+        await close_database()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        sys.exit(asyncio.run(main()))
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,168 @@
+# Model Tiers Module for Marcus Discord Bot
+# Routes each generation to a model and endpoint tier by command, personality and mood
+
+import os
+import json
+import logging
+from collections import deque
+from dotenv import load_dotenv
+
+from Ai_router import AI_API_URLS, EndpointRouter, ai_router
+from Prompt_builder import AI_MAX_TOKENS
+
+# Configure logging
+logger = logging.getLogger('marcus.model_tiers')
+
+# Load environment variables
+load_dotenv()
+MODEL_NAME = os.getenv('MODEL_NAME')
+AI_MODEL_TIERS = json.loads(os.getenv('AI_MODEL_TIERS') or '{}')
+AI_TIER_ROUTES = json.loads(os.getenv('AI_TIER_ROUTES') or '{}')
+
+# Tier used when no route matches, backed by MODEL_NAME on AI_API_URLS
+DEFAULT_TIER = "default"
+
+# Recent latencies kept per tier for percentiles
+LATENCY_SAMPLE_SIZE = 200
+
+class ModelTier:
+    """A model, the servers that run it and its generation latency"""
+
+    def __init__(self, name, model, router, max_tokens, sample_size=LATENCY_SAMPLE_SIZE):
+        """
+        Initialize the tier
+
+        Args:
+            name (str): Tier name used in routes and stats
+            model (str): Model name sent in the payload
+            router (EndpointRouter): Router over the servers running the model
+            max_tokens (int): Response token limit for the tier
+            sample_size (int): Recent latencies kept for percentiles
+        """
+        self.name = name
+        self.model = model
+        self.router = router
+        self.max_tokens = max_tokens
+
+        self._latencies = deque(maxlen=sample_size)
+
+        # Counters for observability
+        self.requests = 0
+        self.failures = 0
+
+    def record(self, elapsed, success):
+        """
+        Record one generation
+
+        Args:
+            elapsed (float): Seconds the generation took, retries included
+            success (bool): Whether the model produced a response
+        """
+        self.requests += 1
+        if success:
+            self._latencies.append(elapsed)
+        else:
+            self.failures += 1
+
+    def get_stats(self):
+        """
+        Get tier counters
+
+        Returns:
+            dict: Model, requests, failures, recent latency percentiles and endpoints
+        """
+        latencies = sorted(self._latencies)
+        return {
+            "model": self.model,
+            "requests": self.requests,
+            "failures": self.failures,
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000) if latencies else None,
+            "endpoints": self.router.get_stats()
+        }
+
+class TierTable:
+    """
+    Routing table from a request's command, personality and mood to a model tier.
+
+    Tiers are configured as {name: {"model", "urls", "max_tokens"}}, any field
+    left out falls back to the default tier's. Routes map "command:<name>",
+    "personality:<name>" or "mood:<name>" to a tier name and are checked in
+    that order, so a command's tier wins over the personality and the mood.
+    Tiers sharing the same servers share one router, so load is counted once.
+    """
+
+    def __init__(self, tiers=AI_MODEL_TIERS, routes=AI_TIER_ROUTES):
+        """
+        Initialize the table
+
+        Args:
+            tiers (dict): Tier name -> {"model", "urls", "max_tokens"}
+            routes (dict): "command:<name>", "personality:<name>" or "mood:<name>" -> tier name
+        """
+        self._routers = {tuple(AI_API_URLS): ai_router}
+        self.tiers = {DEFAULT_TIER: ModelTier(DEFAULT_TIER, MODEL_NAME, ai_router, AI_MAX_TOKENS)}
+
+        for name, spec in tiers.items():
+            urls = spec.get("urls") or AI_API_URLS
+            if isinstance(urls, str):
+                urls = [url.strip() for url in urls.split(',') if url.strip()]
+
+            router = self._routers.get(tuple(urls))
+            if router is None:
+                router = self._routers[tuple(urls)] = EndpointRouter(urls)
+
+            self.tiers[name] = ModelTier(
+                name,
+                spec.get("model", MODEL_NAME),
+                router,
+                int(spec.get("max_tokens", AI_MAX_TOKENS))
+            )
+
+        self.routes = {}
+        for key, name in routes.items():
+            if name not in self.tiers:
+                logger.warning(f"Route {key} points at unknown model tier {name}, ignoring it")
+                continue
+            self.routes[key] = self.tiers[name]
+
+        if len(self.tiers) > 1:
+            logger.info(f"Model tiers: {', '.join(f'{tier.name}={tier.model}' for tier in self.tiers.values())}")
+
+    def resolve(self, personality, mood, command=None):
+        """
+        Find the tier for a request
+
+        Args:
+            personality (str): Active personality
+            mood (str): Current mood of Marcus
+            command (str, optional): Slash command that triggered the request
+
+        Returns:
+            ModelTier: Matching tier, or the default tier
+        """
+        if command is not None:
+            tier = self.routes.get(f"command:{command}")
+            if tier is not None:
+                return tier
+
+        return (self.routes.get(f"personality:{personality}")
+                or self.routes.get(f"mood:{mood}")
+                or self.tiers[DEFAULT_TIER])
+
+    def stop(self):
+        """Stop the health probes of every tier's router"""
+        for router in self._routers.values():
+            router.stop()
+
+    def get_stats(self):
+        """
+        Get counters for every tier
+
+        Returns:
+            dict: Tier name -> stats dict
+        """
+        return {name: tier.get_stats() for name, tier in self.tiers.items()}
+
+# Shared routing table used by get_ai_response and stream_ai_response
+model_tiers = TierTable()
@@ -2,13 +2,18 @@
 # Handles different personality aspects and determines which one should respond
 
 import random
-import re
 import logging
 from enum import Enum
 
+from Trigger_matcher import TriggerMatcher
+
 # Configure logging
 logger = logging.getLogger('marcus.personality')
 
+# Matcher categories besides the personalities
+PROFANITY = "profanity"
+SWEET_TALK = "sweet_talk"
+
 class PersonalityType(Enum):
     """Enumeration of different personality aspects Marcus can exhibit"""
     CRYPTIC = "cryptic"
@@ -54,19 +59,22 @@ class PersonalityManager:
             ]
         }
         
-        # Profanity patterns for immediate rage responses
-        self.profanity_pattern = re.compile(r'\b(fuck|shit|damn|bitch|asshole|crap|dick)\b', re.IGNORECASE)
-        
-        # Sweet talk patterns that reduce rage
-        self.sweet_talk_patterns = [
-            r'i love you,? marcus', 
-            r'thank you,? marcus', 
-            r'marcus,? i love you',
-            r'marcus,? thank you',
-            r'good job,? marcus',
-            r'well done,? marcus'
+        # Profanity for immediate rage responses
+        self.profanity = ['fuck', 'shit', 'damn', 'bitch', 'asshole', 'crap', 'dick']
+        
+        # Sweet talk that reduces rage, each pair matched with or without a comma between
+        sweet_talk_pairs = [
+            ('i love you', 'marcus'),
+            ('thank you', 'marcus'),
+            ('marcus', 'i love you'),
+            ('marcus', 'thank you'),
+            ('good job', 'marcus'),
+            ('well done', 'marcus')
         ]
-        self.sweet_talk_regex = re.compile('|'.join(self.sweet_talk_patterns), re.IGNORECASE)
+        self.sweet_talk = [f"{first}{separator}{second}" for first, second in sweet_talk_pairs for separator in (' ', ', ')]
+        
+        # Every trigger compiled into one whole-word matcher, so a message is scanned once
+        self.matcher = TriggerMatcher({**self.triggers, PROFANITY: self.profanity, SWEET_TALK: self.sweet_talk})
     
     def get_responding_personality(self, message_content):
         """
@@ -78,17 +86,18 @@ class PersonalityManager:
         Returns:
             tuple: (personality_type, response_delay)
         """
-        message_lower = message_content.lower()
+        # Count matched triggers per personality, profanity and sweet talk in one pass
+        counts = self.matcher.count(message_content)
         
         # Check for special cases first
         
         # Check for profanity - immediate rage response
-        if self.profanity_pattern.search(message_lower):
+        if counts[PROFANITY]:
             logger.debug("Profanity detected - immediate RAGE response")
             return PersonalityType.RAGE.value, 1.5
             
         # Check for sweet talk - special handling
-        if self.sweet_talk_regex.search(message_lower):
+        if counts[SWEET_TALK]:
             logger.debug("Sweet talk detected")
             if random.random() < 0.7:  # 70% chance of special sweet talk response
                 return PersonalityType.NEUTRAL.value, 2.0
@@ -98,9 +107,9 @@ class PersonalityManager:
         
         # Calculate match scores for each personality
         match_scores = {}
-        for personality, keywords in self.triggers.items():
+        for personality in self.triggers:
             # Calculate what percentage of keywords are in the message
-            matches = sum(1 for keyword in keywords if keyword in message_lower)
+            matches = counts[personality]
             match_score = min(1.0, matches / 5)  # Cap at 1.0
             match_scores[personality] = match_score
             
@@ -0,0 +1,63 @@
+# Prefill Benchmark for Marcus Discord Bot
+# Compares cached and uncached prompt prefill on the local model server
+
+import sys
+import time
+import asyncio
+import argparse
+
+from Ai_client import get_ai_client, close_ai_clients
+from Ai_connection import AI_API_URL, AI_API_PATH, _build_payload, record_prefill, get_prefill_stats, prefill_stats
+
+async def run_pass(client, cache_prompt, samples):
+    """
+    Send a series of single-token requests sharing the Marcus prompt prefix
+    
+    Args:
+        client (AIClient): Client for the model server
+        cache_prompt (bool): Whether the server may reuse its prompt cache
+        samples (int): Number of requests to send
+        
+    Returns:
+        float: Average wall-clock seconds per request
+    """
+    total = 0.0
+    for index in range(samples):
+        # Same prefix and mood every time, only the user message differs
+        payload = _build_payload(f"benchmark message {index}", "neutral", "default", None)
+        payload["cache_prompt"] = cache_prompt
+        payload["max_tokens"] = 1  # Prefill-dominated request
+        
+        start = time.perf_counter()
+        status, result = await client.post_json(AI_API_PATH, payload)
+        total += time.perf_counter() - start
+        
+        if status != 200:
+            print(f"Request failed: {status} - {result}")
+            continue
+        record_prefill(result)
+    
+    return total / samples
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure cached vs uncached prompt prefill")
+    parser.add_argument("--samples", type=int, default=10, help="Requests per pass")
+    args = parser.parse_args()
+    
+    client = get_ai_client(AI_API_URL)
+    try:
+        for cache_prompt in (False, True):
+            for key in prefill_stats:
+                prefill_stats[key] = 0 if isinstance(prefill_stats[key], int) else 0.0
+            
+            average = await run_pass(client, cache_prompt, args.samples)
+            print(f"cache_prompt={cache_prompt}: {average * 1000:.1f} ms per request")
+            print(f"  server report: {get_prefill_stats()}")
+    finally:
+        await close_ai_clients()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
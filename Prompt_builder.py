@@ -0,0 +1,196 @@
+# Prompt Builder Module for Marcus Discord Bot
+# Builds chat prompts that fit a token budget measured with the model's tokenizer
+
+import os
+import logging
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.prompt_builder')
+
+# Load environment variables
+load_dotenv()
+AI_TOKENIZER = os.getenv('AI_TOKENIZER', os.getenv('MODEL_NAME', ''))
+AI_INPUT_TOKEN_BUDGET = int(os.getenv('AI_INPUT_TOKEN_BUDGET', '2048'))
+AI_MAX_TOKENS = int(os.getenv('AI_MAX_TOKENS', '150'))
+
+# Chat templates add a few tokens of role markup around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough characters-per-token used until (or unless) the real tokenizer is available
+FALLBACK_CHARS_PER_TOKEN = 4
+
+# Token counts are memoized per string, history is re-sent on every call
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+class PromptBuilder:
+    """
+    Builds the chat message list for a request within an input token budget.
+
+    Tokens are counted with the model's tokenizer (loaded once, in the
+    background) and memoized per string. When the prompt would not fit, the
+    oldest history exchanges are dropped first and then the user's message
+    is truncated, so prefill cost stays bounded whatever users paste.
+    """
+
+    def __init__(self, tokenizer_name=AI_TOKENIZER, input_budget=AI_INPUT_TOKEN_BUDGET):
+        """
+        Initialize the builder
+
+        Args:
+            tokenizer_name (str): Hugging Face model ID or local path of the tokenizer
+            input_budget (int): Maximum prompt tokens sent to the model
+        """
+        self.tokenizer_name = tokenizer_name
+        self.input_budget = input_budget
+
+        self._tokenizer = None
+        self._counts = {}
+
+        # Counters for observability
+        self.prompts_built = 0
+        self.prompts_trimmed = 0
+        self.tokens_dropped = 0
+        self.exchanges_dropped = 0
+        self.messages_truncated = 0
+
+    def load_tokenizer(self):
+        """
+        Load the tokenizer (blocking, run it in an executor)
+
+        Returns:
+            bool: True if the real tokenizer is available
+        """
+        if self._tokenizer is not None:
+            return True
+        if not self.tokenizer_name:
+            logger.warning("No tokenizer configured, estimating prompt tokens from length")
+            return False
+
+        try:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+            self._counts.clear()
+            logger.info(f"Loaded tokenizer {self.tokenizer_name}")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer {self.tokenizer_name}, estimating prompt tokens from length: {e}")
+            return False
+
+    def count_tokens(self, text):
+        """
+        Count the tokens in a piece of text
+
+        Args:
+            text (str): Text to measure
+
+        Returns:
+            int: Number of tokens
+        """
+        count = self._counts.get(text)
+        if count is not None:
+            return count
+
+        if self._tokenizer is not None:
+            count = len(self._tokenizer.encode(text, add_special_tokens=False))
+        else:
+            count = (len(text) + FALLBACK_CHARS_PER_TOKEN - 1) // FALLBACK_CHARS_PER_TOKEN
+
+        if len(self._counts) >= TOKEN_COUNT_CACHE_SIZE:
+            self._counts.clear()
+        self._counts[text] = count
+        return count
+
+    def truncate(self, text, max_tokens):
+        """
+        Cut text down to at most max_tokens tokens
+
+        Args:
+            text (str): Text to truncate
+            max_tokens (int): Tokens to keep
+
+        Returns:
+            str: The leading part of the text
+        """
+        if max_tokens <= 0:
+            return ""
+
+        if self._tokenizer is not None:
+            ids = self._tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+            return self._tokenizer.decode(ids)
+
+        return text[:max_tokens * FALLBACK_CHARS_PER_TOKEN]
+
+    def build(self, system_prompt, history, user_message):
+        """
+        Build the chat message list within the input budget
+
+        Args:
+            system_prompt (str): Complete system prompt (always kept)
+            history (list): (user_message, assistant_message) tuples, oldest first
+            user_message (str): The new user message
+
+        Returns:
+            tuple: (messages, dropped_tokens)
+        """
+        used = self.count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        user_tokens = self.count_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+        dropped = 0
+
+        # Keep the newest exchanges that fit alongside the full user message
+        kept = []
+        for index in range(len(history) - 1, -1, -1):
+            user_text, assistant_text = history[index]
+            cost = self.count_tokens(user_text) + self.count_tokens(assistant_text) + 2 * MESSAGE_OVERHEAD_TOKENS
+            if used + cost + user_tokens > self.input_budget:
+                # This exchange and everything older is dropped
+                for older_user, older_assistant in history[:index + 1]:
+                    dropped += self.count_tokens(older_user) + self.count_tokens(older_assistant) + 2 * MESSAGE_OVERHEAD_TOKENS
+                self.exchanges_dropped += index + 1
+                break
+            kept.append((user_text, assistant_text))
+            used += cost
+        kept.reverse()
+
+        # Then truncate the user message if it still doesn't fit
+        remaining = self.input_budget - used - MESSAGE_OVERHEAD_TOKENS
+        if user_tokens - MESSAGE_OVERHEAD_TOKENS > remaining:
+            dropped += user_tokens - MESSAGE_OVERHEAD_TOKENS - max(remaining, 0)
+            user_message = self.truncate(user_message, remaining)
+            self.messages_truncated += 1
+
+        messages = [{"role": "system", "content": system_prompt}]
+        for user_text, assistant_text in kept:
+            messages.extend([
+                {"role": "user", "content": user_text},
+                {"role": "assistant", "content": assistant_text}
+            ])
+        messages.append({"role": "user", "content": user_message})
+
+        self.prompts_built += 1
+        if dropped:
+            self.prompts_trimmed += 1
+            self.tokens_dropped += dropped
+            logger.info(f"Prompt over budget, dropped {dropped} tokens")
+
+        return messages, dropped
+
+    def get_stats(self):
+        """
+        Get builder counters
+
+        Returns:
+            dict: Prompts built and trimmed, tokens and exchanges dropped, truncations
+        """
+        return {
+            "tokenizer_loaded": self._tokenizer is not None,
+            "input_budget": self.input_budget,
+            "prompts_built": self.prompts_built,
+            "prompts_trimmed": self.prompts_trimmed,
+            "tokens_dropped": self.tokens_dropped,
+            "exchanges_dropped": self.exchanges_dropped,
+            "messages_truncated": self.messages_truncated
+        }
+
+# Shared builder used by get_ai_response
+prompt_builder = PromptBuilder()
@@ -0,0 +1,121 @@
+# Rage Tracker Module for Marcus Discord Bot
+# In-memory per-user rage levels with lazy time-based decay
+
+import os
+import time
+import logging
+from dotenv import load_dotenv
+
+from Database_connection import load_rage_levels
+
+# Configure logging
+logger = logging.getLogger('marcus.rage')
+
+# Load environment variables
+load_dotenv()
+RAGE_DECAY_PER_HOUR = float(os.getenv('RAGE_DECAY_PER_HOUR', '10'))
+
+# Seconds between load attempts while the database is unreachable
+LOAD_RETRY_INTERVAL = 30
+
+# Rage level bounds
+MIN_RAGE = 0
+MAX_RAGE = 100
+
+class RageTracker:
+    """
+    Per-user rage levels, held in memory as the runtime source of truth.
+
+    Each entry stores the level and when it was last changed. Rage cools
+    down linearly, computed from that timestamp whenever the level is read,
+    so there are no timers or sweeps. Stored levels are loaded once; changes
+    are written back in batches along with the interaction that caused them.
+    """
+
+    def __init__(self, decay_per_hour=RAGE_DECAY_PER_HOUR):
+        """
+        Initialize the tracker
+
+        Args:
+            decay_per_hour (float): Rage points lost per hour without changes
+        """
+        self.decay_per_second = decay_per_hour / 3600.0
+        self._levels = {}  # user_id -> (level, time.time() when set)
+        self.loaded = False
+        self._next_load = 0.0
+
+    async def ensure_loaded(self):
+        """
+        Load stored rage levels once (retried on the next call if the database is unavailable)
+
+        Returns:
+            bool: True if stored levels are loaded
+        """
+        if self.loaded:
+            return True
+        if time.monotonic() < self._next_load:
+            return False
+
+        self._next_load = time.monotonic() + LOAD_RETRY_INTERVAL
+        rows = await load_rage_levels()
+        if rows is None:
+            return False
+
+        now = time.time()
+        for user_id, level, seconds_ago in rows:
+            # Changes made while the database was unreachable are newer
+            self._levels.setdefault(user_id, (level, now - seconds_ago))
+
+        self.loaded = True
+        logger.info(f"Loaded {len(rows)} stored rage levels")
+        return True
+
+    def get(self, user_id):
+        """
+        Get a user's current rage level, decay included
+
+        Args:
+            user_id (int): Discord user ID
+
+        Returns:
+            int: Current rage level (0-100)
+        """
+        entry = self._levels.get(user_id)
+        if entry is None:
+            return MIN_RAGE
+
+        level, updated_at = entry
+        level = max(MIN_RAGE, level - (time.time() - updated_at) * self.decay_per_second)
+        if level == MIN_RAGE:
+            del self._levels[user_id]  # Fully cooled down, no need to keep it
+        return round(level)
+
+    def change(self, user_id, change):
+        """
+        Change a user's rage level
+
+        Args:
+            user_id (int): Discord user ID
+            change (int): Amount to change the rage level by
+
+        Returns:
+            int: New rage level (0-100), to be recorded with the interaction
+        """
+        level = max(MIN_RAGE, min(MAX_RAGE, self.get(user_id) + change))
+        self._levels[user_id] = (level, time.time())
+        return level
+
+    def get_stats(self):
+        """
+        Get tracker counters
+
+        Returns:
+            dict: Whether stored levels are loaded and how many users are tracked
+        """
+        return {
+            "loaded": self.loaded,
+            "users": len(self._levels)
+        }
+
+# Shared tracker used by the commands cog
+rage_tracker = RageTracker()
@@ -0,0 +1,106 @@
+# Reply Pacing Module for Marcus Discord Bot
+# Holds replies back to a minimum time-to-reply while generation runs in the meantime
+
+import time
+import asyncio
+import logging
+
+# Configure logging
+logger = logging.getLogger('marcus.pacing')
+
+class ReplyPace:
+    """Earliest moment one reply may be delivered"""
+
+    def __init__(self, pacer, ready_at):
+        """
+        Initialize the pace
+
+        Args:
+            pacer (ReplyPacer): Pacer that counts the outcome
+            ready_at (float): time.monotonic() before which the reply is held
+        """
+        self.pacer = pacer
+        self.ready_at = ready_at
+
+    async def wait(self):
+        """Wait until the reply may be delivered (returns at once if generation already took longer)"""
+        remaining = self.ready_at - time.monotonic()
+        if remaining > 0:
+            self.pacer.held += 1
+            self.pacer.held_seconds += remaining
+            await asyncio.sleep(remaining)
+        else:
+            self.pacer.overran += 1
+        self.pacer.paced += 1
+
+    def wrap(self, send):
+        """
+        Hold a send function until the reply may be delivered
+
+        Only the first call waits, so streamed edits after it aren't slowed down.
+
+        Args:
+            send (callable): Coroutine function that delivers the reply (e.g. message.reply)
+
+        Returns:
+            callable: Coroutine function with the same arguments
+        """
+        waited = False
+
+        async def paced_send(*args, **kwargs):
+            nonlocal waited
+            if not waited:
+                waited = True
+                await self.wait()
+            return await send(*args, **kwargs)
+
+        return paced_send
+
+class ReplyPacer:
+    """
+    Turns personality and mood delays into a minimum time-to-reply.
+
+    The delay starts counting when the trigger arrives and generation starts
+    straight away, so the reply keeps its deliberate feel but the delay is only
+    felt when generation is faster than it. The typing indicator stays on until
+    the held reply is delivered.
+    """
+
+    def __init__(self):
+        """Initialize the pacer counters"""
+        self.paced = 0          # Replies delivered through a pace
+        self.held = 0           # Replies held back because generation beat the delay
+        self.held_seconds = 0.0
+        self.overran = 0        # Replies where generation took longer than the delay
+
+    def start(self, min_delay, started_at=None):
+        """
+        Start pacing a reply
+
+        Args:
+            min_delay (float): Minimum seconds between the trigger and the reply
+            started_at (float, optional): time.monotonic() when the trigger arrived, defaults to now
+
+        Returns:
+            ReplyPace: Pace to wait on (or wrap the send with) before delivering
+        """
+        if started_at is None:
+            started_at = time.monotonic()
+        return ReplyPace(self, started_at + min_delay)
+
+    def get_stats(self):
+        """
+        Get pacing counters
+
+        Returns:
+            dict: Paced, held and overran replies and the average hold
+        """
+        return {
+            "paced": self.paced,
+            "held": self.held,
+            "overran": self.overran,
+            "average_hold_ms": round(self.held_seconds * 1000 / self.held) if self.held else 0
+        }
+
+# Shared pacer used by the bot and its commands
+reply_pacer = ReplyPacer()
@@ -0,0 +1,179 @@
+# Response Cache Module for Marcus Discord Bot
+# LRU + TTL cache of model responses for near-identical requests
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.response_cache')
+
+# Load environment variables
+load_dotenv()
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '300'))
+
+# Anything that isn't a letter, digit or space is ignored when comparing messages
+_NORMALIZE_PATTERN = re.compile(r'[^\w\s]+')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def normalize_message(text):
+    """
+    Normalize a user message so trivially different messages share a key
+
+    Args:
+        text (str): Raw user message
+
+    Returns:
+        str: Lowercased message without punctuation and with collapsed whitespace
+    """
+    text = _NORMALIZE_PATTERN.sub(' ', text.lower())
+    return _WHITESPACE_PATTERN.sub(' ', text).strip()
+
+def history_digest(history_messages):
+    """
+    Digest the conversation history sent along with a request
+
+    Args:
+        history_messages (list): Chat messages between the system prompt and the new message
+
+    Returns:
+        str: Short hex digest ("" when there is no history)
+    """
+    if not history_messages:
+        return ""
+    encoded = json.dumps(history_messages, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+class ResponseCache:
+    """
+    In-process cache of raw model responses.
+
+    Entries are keyed on the normalized user message, mood, personality and
+    a digest of the history sent with the request. They expire after a TTL
+    and the least recently used entries are evicted once the entry or byte
+    limit is reached.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 ttl=RESPONSE_CACHE_TTL):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries (int): Maximum number of cached responses
+            max_bytes (int): Maximum approximate memory used by cached entries
+            ttl (float): Seconds an entry stays valid
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (response, expires_at, size)
+        self.bytes_used = 0
+
+        # Counters for observability
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(user_message, mood, personality, history_messages):
+        """
+        Build the cache key for a request
+
+        Args:
+            user_message (str): The user's message
+            mood (str): Current mood of Marcus
+            personality (str): Active personality
+            history_messages (list): Chat messages sent as conversation history
+
+        Returns:
+            tuple: Cache key
+        """
+        return (normalize_message(user_message), mood, personality, history_digest(history_messages))
+
+    def get(self, key):
+        """
+        Look up a cached response
+
+        Args:
+            key (tuple): Key from make_key
+
+        Returns:
+            str: Cached response, or None on a miss
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        response, expires_at, size = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def put(self, key, response):
+        """
+        Store a response
+
+        Args:
+            key (tuple): Key from make_key
+            response (str): Raw model response
+        """
+        if key in self._entries:
+            self._remove(key)
+
+        size = sys.getsizeof(response) + sum(sys.getsizeof(part) for part in key)
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (response, time.monotonic() + self.ttl, size)
+        self.bytes_used += size
+
+        # Evict least recently used entries until both limits hold
+        while len(self._entries) > self.max_entries or self.bytes_used > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        """Drop an entry and its accounted size"""
+        _, _, size = self._entries.pop(key)
+        self.bytes_used -= size
+
+    def get_stats(self):
+        """
+        Get cache counters
+
+        Returns:
+            dict: Hit ratio, entry count, memory use, evictions and expirations
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.bytes_used,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+# Shared cache used by get_ai_response
+response_cache = ResponseCache()
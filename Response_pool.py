@@ -0,0 +1,173 @@
+# Response Pool Module for Marcus Discord Bot
+# Keeps pre-generated responses ready for commands with fixed prompts
+
+import os
+import random
+import asyncio
+import logging
+from collections import deque
+from dotenv import load_dotenv
+
+from Ai_connection import get_ai_response, FALLBACK_RESPONSES
+from Ai_queue import Priority, GenerationRejected, generation_queue
+from Mood import MoodState
+
+# Configure logging
+logger = logging.getLogger('marcus.response_pool')
+
+# Load environment variables
+load_dotenv()
+RESPONSE_POOL_ENABLED = os.getenv('RESPONSE_POOL_ENABLED', 'true').lower() == 'true'
+RESPONSE_POOL_SIZE = int(os.getenv('RESPONSE_POOL_SIZE', '3'))
+RESPONSE_POOL_REFILL_INTERVAL = float(os.getenv('RESPONSE_POOL_REFILL_INTERVAL', '5'))
+
+class ResponsePool:
+    """
+    Pre-generated responses for commands that pick from a fixed prompt list.
+
+    Each (prompt class, mood) pair keeps a few ready responses. A background
+    task tops up the emptiest pool one response at a time, and only while
+    the generation queue is idle, so real users never wait behind it.
+    """
+
+    def __init__(self, pool_size=RESPONSE_POOL_SIZE, refill_interval=RESPONSE_POOL_REFILL_INTERVAL):
+        """
+        Initialize the pool
+
+        Args:
+            pool_size (int): Responses kept ready per (prompt class, mood)
+            refill_interval (float): Seconds between background generations
+        """
+        self.pool_size = pool_size
+        self.refill_interval = refill_interval
+
+        self._classes = {}  # prompt_class -> (prompts, personality)
+        self._pools = {}    # (prompt_class, mood) -> deque of (prompt, response)
+        self._task = None
+
+        # Counters for observability
+        self.hits = {}
+        self.misses = {}
+        self.generated = 0
+
+    def register(self, prompt_class, prompts, personality="default"):
+        """
+        Register a prompt class to keep responses ready for
+
+        Args:
+            prompt_class (str): Name of the class (e.g. "quote")
+            prompts (list): Prompts the command picks from
+            personality (str): Personality used to generate the responses
+        """
+        self._classes[prompt_class] = (list(prompts), personality)
+        self.hits.setdefault(prompt_class, 0)
+        self.misses.setdefault(prompt_class, 0)
+        for mood in MoodState:
+            self._pools.setdefault((prompt_class, mood.value), deque(maxlen=self.pool_size))
+
+    def take(self, prompt_class, mood):
+        """
+        Take a ready response if one exists
+
+        Args:
+            prompt_class (str): Registered prompt class
+            mood (str): Current mood of Marcus
+
+        Returns:
+            tuple: (prompt, response), or None if the pool is empty
+        """
+        pool = self._pools.get((prompt_class, mood))
+        if pool:
+            self.hits[prompt_class] += 1
+            return pool.popleft()
+
+        if prompt_class in self.misses:
+            self.misses[prompt_class] += 1
+        return None
+
+    def start(self):
+        """Start the background refill task"""
+        if RESPONSE_POOL_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._refill_loop())
+            logger.info(f"Response pool refill started (size: {self.pool_size}, interval: {self.refill_interval}s)")
+
+    def stop(self):
+        """Stop the background refill task"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _refill_loop(self):
+        """Top up the emptiest pool whenever the model is idle"""
+        while True:
+            await asyncio.sleep(self.refill_interval)
+
+            if not generation_queue.idle:
+                continue
+
+            key = self._emptiest()
+            if key is None:
+                continue
+
+            try:
+                await self._refill(key)
+            except GenerationRejected:
+                pass  # A user arrived first, try again later
+            except Exception as e:
+                logger.error(f"Error refilling response pool {key}: {e}")
+
+    def _emptiest(self):
+        """
+        Find the pool with the most missing responses
+
+        Returns:
+            tuple: (prompt_class, mood), or None if every pool is full
+        """
+        key, pool = min(self._pools.items(), key=lambda item: len(item[1]), default=(None, None))
+        if key is None or len(pool) >= self.pool_size:
+            return None
+        return key
+
+    async def _refill(self, key):
+        """
+        Generate one response for a pool
+
+        Args:
+            key (tuple): (prompt_class, mood)
+        """
+        prompt_class, mood = key
+        prompts, personality = self._classes[prompt_class]
+        prompt = random.choice(prompts)
+
+        # Cached text would fill the pool with copies of the same response
+        response = await get_ai_response(prompt, mood, personality, priority=Priority.BACKGROUND, use_cache=False,
+                                         command=prompt_class)
+        if response in FALLBACK_RESPONSES:
+            return  # Model unreachable, don't keep outage text around for later
+
+        self._pools[key].append((prompt, response))
+        self.generated += 1
+        logger.debug(f"Pre-generated response for {prompt_class}/{mood}")
+
+    def get_stats(self):
+        """
+        Get pool counters
+
+        Returns:
+            dict: Hits, misses, hit ratio and fill level per prompt class
+        """
+        stats = {}
+        for prompt_class in self._classes:
+            hits = self.hits[prompt_class]
+            misses = self.misses[prompt_class]
+            stats[prompt_class] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+                "ready": {mood: len(pool) for (name, mood), pool in self._pools.items() if name == prompt_class}
+            }
+        stats["generated"] = self.generated
+        return stats
+
+# Shared pool used by the commands cog
+response_pool = ResponsePool()
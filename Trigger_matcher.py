@@ -0,0 +1,114 @@
+# Trigger Matcher Module for Marcus Discord Bot
+# Finds every trigger phrase in a message in one pass with an Aho-Corasick automaton
+
+import logging
+
+# Configure logging
+logger = logging.getLogger('marcus.triggers')
+
+def _is_word_char(char):
+    """Whether a character counts as part of a word, as for regex \\b"""
+    return char.isalnum() or char == '_'
+
+class TriggerMatcher:
+    """
+    Case-insensitive whole-word matcher for many phrases at once.
+
+    Every phrase of every category is compiled into one Aho-Corasick
+    automaton, so a message is scanned once no matter how many phrases
+    there are. A match only counts when it isn't part of a longer word:
+    "bad" matches in "that's bad!" but not in "badge".
+    """
+
+    def __init__(self, categories):
+        """
+        Build the automaton
+
+        Args:
+            categories (dict): Category -> list of phrases (a phrase may appear in several categories)
+        """
+        self._goto = [{}]       # state -> {char: next state}
+        self._fail = [0]        # state -> longest proper suffix state
+        self._output = [[]]     # state -> [(phrase length, phrase id)] ending here
+        self._categories = []   # phrase id -> categories it belongs to
+        self.categories = list(categories)
+
+        phrase_ids = {}
+        for category, phrases in categories.items():
+            for phrase in phrases:
+                phrase = phrase.lower()
+                if not phrase:
+                    continue
+                if phrase not in phrase_ids:
+                    phrase_ids[phrase] = len(self._categories)
+                    self._categories.append([])
+                    self._add(phrase, phrase_ids[phrase])
+                if category not in self._categories[phrase_ids[phrase]]:
+                    self._categories[phrase_ids[phrase]].append(category)
+
+        self._link()
+        logger.debug(f"Compiled {len(phrase_ids)} trigger phrases into {len(self._goto)} states")
+
+    def _add(self, phrase, phrase_id):
+        """Add a phrase to the trie"""
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(phrase), phrase_id))
+
+    def _link(self):
+        """Compute failure links breadth-first and merge outputs along them"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def count(self, text):
+        """
+        Count the distinct phrases of each category found in a text
+
+        Args:
+            text (str): Message content
+
+        Returns:
+            dict: Category -> number of distinct phrases matched as whole words (every category present)
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        text = text.lower()
+        length = len(text)
+        matched = set()
+        state = 0
+
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for phrase_length, phrase_id in output[state]:
+                if phrase_id in matched:
+                    continue
+                # Whole words only: no word character right before or after the match
+                start = position - phrase_length + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if position + 1 < length and _is_word_char(text[position + 1]):
+                    continue
+                matched.add(phrase_id)
+
+        counts = dict.fromkeys(self.categories, 0)
+        for phrase_id in matched:
+            for category in self._categories[phrase_id]:
+                counts[category] += 1
+        return counts
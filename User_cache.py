@@ -0,0 +1,94 @@
+# User Cache Module for Marcus Discord Bot
+# Process-local cache of users already written to the users table
+
+import os
+import logging
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger('marcus.user_cache')
+
+# Load environment variables
+load_dotenv()
+USER_CACHE_MAX_USERS = int(os.getenv('USER_CACHE_MAX_USERS', '100000'))
+
+class UserCache:
+    """
+    Users known to have a row in the users table, with their stored username.
+
+    A user missing from the cache (never seen by this process, or evicted
+    least recently used first) only costs one extra upsert the next time
+    they interact.
+    """
+
+    def __init__(self, max_users=USER_CACHE_MAX_USERS):
+        """
+        Initialize the cache
+
+        Args:
+            max_users (int): Users kept in the cache
+        """
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> username, least recently used first
+
+        # Counters for observability
+        self.hits = 0
+        self.misses = 0
+
+    def is_current(self, user_id, username):
+        """
+        Check whether the stored row for a user is up to date
+
+        Args:
+            user_id (int): Discord user ID
+            username (str): Current Discord username
+
+        Returns:
+            bool: True if the user is known with this username
+        """
+        if self._users.get(user_id) == username:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def remember(self, user_id, username):
+        """
+        Mark a user as stored with a username
+
+        Args:
+            user_id (int): Discord user ID
+            username (str): Username in the stored row
+        """
+        self._users[user_id] = username
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def forget(self, user_id):
+        """
+        Drop a user whose row may not exist after all
+
+        Args:
+            user_id (int): Discord user ID
+        """
+        self._users.pop(user_id, None)
+
+    def get_stats(self):
+        """
+        Get cache counters
+
+        Returns:
+            dict: Cached users, hits and misses
+        """
+        return {
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+# Shared cache used by the interaction recorder
+user_cache = UserCache()